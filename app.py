@@ -1,188 +1,197 @@
 import os
-import re
-import subprocess
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Optional
 
-from cs50 import SQL
-from flask import Flask, flash, redirect, render_template, request, session, jsonify
-from flask_session import Session
+from flask import Flask, flash, make_response, redirect, render_template, request, session, jsonify
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from helpers import apology, login_required, lookup, usd, process_holdings
-
-# Optional: use pypandoc if available; otherwise fall back to calling pandoc binary
-try:
-    import pypandoc  # type: ignore
-except Exception:
-    pypandoc = None
+import migrations
+import sessions
+from attempt_log import AttemptLog
+from catalog import ProblemCatalog
+from database import DB_MMAP_SIZE, Database
+from latex import latex_to_html, source_hash
+from static_assets import VERSION_ARG, asset_version, static_url
 
 # Configure application
 app = Flask(__name__)
 
 # Custom filter
 app.jinja_env.filters["usd"] = usd
+# Content-hashed static URLs, cacheable forever (see static_assets.py)
+app.jinja_env.globals["static_url"] = static_url
 
-# Configure session to use filesystem (instead of signed cookies)
+# Configure sessions: SQLite store by default, or signed cookies / the old
+# filesystem store (see sessions.py)
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+sessions.init_app(app)
+
+# SQLite databases: per-thread WAL connections (see database.py)
+USERS_DB_PATH = "users.db"
+PROBLEMS_DB_PATH = "problems.db"
+ATTEMPTS_DB_PATH = "attempts.db"
+db = Database(USERS_DB_PATH)
+attempts_db = Database(ATTEMPTS_DB_PATH)
+# The problem bank is only written by the importer: read it without locks
+# contending with attempt writes, and follow it when a rebuild swaps the file
+problems_db = Database(PROBLEMS_DB_PATH, follow_swaps=True, readonly=True, mmap_size=DB_MMAP_SIZE)
+
+# Bring the databases up to the current schema (columns, tables, indexes),
+# and move attempts still stored in problems.db over to attempts.db
+migrations.migrate_file(PROBLEMS_DB_PATH, migrations.PROBLEMS_MIGRATIONS)
+migrations.migrate_file(ATTEMPTS_DB_PATH, migrations.ATTEMPTS_MIGRATIONS)
+migrations.migrate_file(USERS_DB_PATH, migrations.USERS_MIGRATIONS)
+migrations.move_attempts(PROBLEMS_DB_PATH, ATTEMPTS_DB_PATH)
+
+# Problems, topics and problem_topics are static between imports: serve them
+# (and random problem selection) from memory instead of SQLite
+catalog = ProblemCatalog(problems_db)
+
+# Answers logged on /study are written to problem_attempts in the background
+# (see attempt_log.py for the durability setting)
+attempt_log = AttemptLog(attempts_db)
+
+
+# Background rendering: text/answer conversions run side by side, and the
+# next random problem for each (user, topic, skip_solved) is picked and
+# rendered while the user is still working on the current one.
+RENDER_THREADS = int(os.environ.get("RENDER_THREADS", "4"))
+PREFETCH_MAX = 1024  # bound on outstanding prefetches kept in memory
+_RENDER_EXECUTOR = ThreadPoolExecutor(max_workers=RENDER_THREADS, thread_name_prefix="render")
+_PREFETCH: dict[tuple[int, str, bool], Future] = {}
+_PREFETCH_LOCK = threading.Lock()
+
+
+def _attach_html(problem: dict, with_answer: bool = False, parallel: bool = True) -> dict:
+    """Fill in html_text (and html_answer, if `with_answer`) for a problem row.
+
+    Serves the HTML precompiled at import time when its source hash still
+    matches the row; only stale or missing rows go through Pandoc. Answers
+    are only shown after "reveal", so they are rendered on demand: pass
+    `with_answer=True` there. Text and answer are converted concurrently
+    unless `parallel` is False.
+    """
+    stored_hash = problem.get("html_hash")
+    if stored_hash and stored_hash == source_hash(problem.get("text"), problem.get("answer")):
+        return problem
+
+    text = problem.get("text")
+    answer = problem.get("answer") if with_answer else None
+    if parallel and text is not None and answer is not None:
+        answer_future = _RENDER_EXECUTOR.submit(latex_to_html, answer)
+        problem["html_text"] = latex_to_html(text)
+        problem["html_answer"] = answer_future.result()
+    else:
+        problem["html_text"] = latex_to_html(text)
+        problem["html_answer"] = latex_to_html(answer)
+    return problem
 
-# Configure CS50 Library to use SQLite database
-db = SQL("sqlite:///users.db")
-problems_db = SQL("sqlite:///problems.db")
 
-# Path to your macros file (adjust if needed)
-MACROS_PATH = os.path.join(os.path.dirname(__file__), "static", "macros.tex")
-_LATEX_MACROS_CACHE: str | None = None
+def _solved_problem_ids(user_id: int) -> set[int]:
+    """Return ids of problems the user has answered correctly at least once."""
+    rows = attempts_db.query(
+        "SELECT DISTINCT problem_id FROM problem_attempts WHERE user_id = ? AND correct = 1",
+        user_id,
+    )
+    solved = {r[0] for r in rows}
+    # include answers still waiting in the write-behind log
+    solved.update(a.problem_id for a in attempt_log.pending_for(user_id) if a.correct)
+    return solved
 
-def _get_latex_macros() -> str:
-    """Load LaTeX macro definitions from static/macros.tex, cached in memory."""
-    global _LATEX_MACROS_CACHE
-    if _LATEX_MACROS_CACHE is not None:
-        return _LATEX_MACROS_CACHE
 
-    try:
-        with open(MACROS_PATH, "r", encoding="utf-8") as f:
-            _LATEX_MACROS_CACHE = f.read()
-    except OSError:
-        # If the file is missing, just use an empty string so things still render.
-        _LATEX_MACROS_CACHE = ""
-    return _LATEX_MACROS_CACHE
+def _pick_problem(selected_topic: str, exclude: set[int] | frozenset = frozenset(), parallel: bool = True) -> tuple[dict | None, list[str]]:
+    """Choose a random problem for the topic (skipping `exclude`) and render it.
 
+    Returns (problem, topic names), or (None, []) if no problem qualifies.
+    """
+    problem_id = catalog.sample(selected_topic, exclude)
+    if problem_id is None:
+        return None, []
 
-def _rewrite_image_paths(html: str) -> str:
-    """Rewrite image src attributes from Pandoc output to point to Flask static files.
+    problem = _attach_html(catalog.get(problem_id).as_dict(), parallel=parallel)
+    return problem, catalog.topic_names(problem_id)
 
-    Assumes you've put PNGs in static/figures with the same base names as the
-    LaTeX figures.
-    """
-    if not html:
-        return html
 
-    def repl(match):
-        prefix, src, quote = match.group(1), match.group(2), match.group(3)
-        src_norm = src.lstrip("./")  # remove leading ./ but KEEP no leading /
+def _prefetch_job(selected_topic: str, exclude: set[int] | frozenset) -> tuple[dict | None, list[str]]:
+    # already on a render thread, so don't fan out again (avoids the pool
+    # waiting on itself)
+    return _pick_problem(selected_topic, exclude, parallel=False)
 
-        # Case 1: src="figures/chain15.pdf" or "figures/chain15.jpg" or "figures/chain15.png"
-        if src_norm.startswith("figures/"):
-            rel = src_norm[len("figures/"):]  # "chain15.pdf"
-            base, ext = os.path.splitext(rel)
-            # Always point to PNG under /static/figures/
-            return f'{prefix}/static/figures/{base}.png{quote}'
 
-        # Case 2: src="static/figures/chain15.png" (missing leading slash)
-        if src_norm.startswith("static/figures/"):
-            return f'{prefix}/static/{src_norm[len("static/") :]}{quote}'
+def _prefetch_next_problem(user_id: int, selected_topic: str, skip_solved: bool, current_id: int) -> None:
+    """Start picking and rendering the user's next problem in the background."""
+    key = (user_id, selected_topic, skip_solved)
+    with _PREFETCH_LOCK:
+        if key in _PREFETCH:
+            return
 
-        # Otherwise, leave it alone
-        return f"{prefix}{src}{quote}"
+    # The current problem may be marked right before the prefetch is used,
+    # so never prefetch it when skipping solved problems
+    exclude = (_solved_problem_ids(user_id) | {current_id}) if skip_solved else frozenset()
 
-    pattern = re.compile(r'(<img\b[^>]*\bsrc=["\'])([^"\']+)(["\'])', flags=re.IGNORECASE)
-    return pattern.sub(repl, html)
+    with _PREFETCH_LOCK:
+        if key in _PREFETCH:
+            return
+        while len(_PREFETCH) >= PREFETCH_MAX:
+            # drop the oldest outstanding prefetch
+            _PREFETCH.pop(next(iter(_PREFETCH)))
+        _PREFETCH[key] = _RENDER_EXECUTOR.submit(_prefetch_job, selected_topic, exclude)
 
 
-def _clean_latex_text(text: str) -> str:
-    """Return a copy of LaTeX text with leading TeX comment markers removed per-line.
+def _next_problem(user_id: int, selected_topic: str, skip_solved: bool) -> tuple[dict | None, list[str]]:
+    """Return the prefetched next problem if there is one, else pick one now."""
+    with _PREFETCH_LOCK:
+        future = _PREFETCH.pop((user_id, selected_topic, skip_solved), None)
+    if future is not None:
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"prefetch failed, picking a problem inline: {e}")
+    exclude = _solved_problem_ids(user_id) if skip_solved else frozenset()
+    return _pick_problem(selected_topic, exclude)
 
-    This keeps the original DB content intact but ensures the HTML view shows the
-    commented-out lines (our importer may have prefixed lines with '%').
-    """
-    if text is None:
-        return text
-    
-    # Remove full-line comments
-    cleaned = re.sub(r'(?m)^[ \t]*%.*(?:\n|$)', '', text)
-
-    # Replace \textnormal{...} with \mathrm{...} so Pandoc's math parser understands it
-    cleaned = re.sub(r'\\textnormal\{([^}]*)\}', r'\\mathrm{\1}', cleaned)
-
-    # Remove leading \noin or \noindent at the very start (plus any following whitespace)
-    cleaned = re.sub(r'^\s*\\noin\b\s*', '', cleaned)
-    cleaned = re.sub(r'^\s*\\noindent\b\s*', '', cleaned)
-
-    # Pandoc's LaTeX math parser does not support the low-level primitive
-    # \displaylimits (used to alter operator limit placement). Replace it
-    # with \limits (or remove) so Pandoc can parse limits like \lim_{n\to\infty}.
-    cleaned = re.sub(r'\\displaylimits', r'\\limits', cleaned)
-
-    # Rewrite \includegraphics paths from .pdf/.jpg/.jpeg to .png
-    cleaned = re.sub(
-        r'(\\includegraphics(?:\[[^\]]*\])?\{)figures/([^}]+?)(?:\.pdf|\.jpg|\.jpeg)(\})',
-        r'\1figures/\2.png\3',
-        cleaned,
-    )
 
-    return cleaned
+# Largest batch accepted by the game ingest endpoints
+MAX_BATCH = 500
 
 
-def _latex_to_html(text: str | None) -> str | None:
-    """Convert LaTeX snippet to HTML using pypandoc or pandoc binary.
+def _insert_rows(database, insert_sql: str, rows: list[tuple]) -> None:
+    """Insert many rows with one prepared statement in a single transaction."""
+    placeholders = "(" + ", ".join("?" * len(rows[0])) + ")"
+    with database.transaction():
+        database.run_many(f"{insert_sql} VALUES {placeholders}", rows)
 
-    - Prepends macros from static/macros.tex so commands like \\Pois are known.
-    - Enables the latex_macros extension in Pandoc.
-    - Uses MathML output so math renders without MathJax.
 
-    Returns None if input is None. On error, falls back to returning
-    the original text wrapped in <pre> to avoid losing content.
-    """
-    if text is None:
-        return None
-
-    cleaned = _clean_latex_text(text)
-    macros = _get_latex_macros()
-
-    # Feed macros + body into Pandoc so it sees the \\newcommand definitions
-    full_input = (macros + "\n" + cleaned) if macros else cleaned
-
-    # Try pypandoc first
-    try:
-        if pypandoc is not None:
-            html = pypandoc.convert_text(
-                full_input,
-                to="html",
-                format="latex+latex_macros",
-                extra_args=["--mathml", "--resource-path=static"],  # make math render without MathJax
-            )
-            # rewrite image paths so they point at Flask's /static/ location
-            return _rewrite_image_paths(html)
-    except Exception:
-        pass
-
-    # Fall back to calling pandoc binary if available
-    try:
-        proc = subprocess.run(
-            [
-                "pandoc",
-                "-f",
-                "latex+latex_macros",  # understand \newcommand definitions
-                "-t",
-                "html",
-                "--mathml",            # emit MathML for equations
-                "--resource-path=static",
-            ],
-            input=full_input,
-            text=True,
-            capture_output=True,
-            check=True,
-        )
-        html = proc.stdout
-        return _rewrite_image_paths(html)
-    except Exception:
-        # As a final fallback, return plain text inside <pre>
-        print("exception in _latex_to_html, falling back to <pre>")
-        safe_text = (
-            "<pre>"
-            + cleaned.replace("&", "&amp;")
-                     .replace("<", "&lt;")
-                     .replace(">", "&gt;")
-            + "</pre>"
-        )
-        return safe_text
+# How long browsers may reuse a static file fetched without a content hash
+# (e.g. figures linked from problem HTML) before revalidating its ETag
+STATIC_MAX_AGE = 3600
 
 
 @app.after_request
 def after_request(response):
-    """Ensure responses aren't cached"""
+    """Set the cache policy for each response.
+
+    - Static files fetched through static_url() (current content hash in
+      ?v=) never change, so browsers keep them for a year.
+    - Other static files are cached briefly and then revalidated.
+    - Routes that set their own Cache-Control (ETagged problem pages) keep it.
+    - Everything else depends on the session, so it is never stored.
+    """
+    if request.endpoint == "static":
+        version = request.args.get(VERSION_ARG)
+        if version and version == asset_version(request.view_args["filename"]):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}"
+        return response
+
+    if "Cache-Control" in response.headers:
+        return response
+
     response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     response.headers["Expires"] = 0
     response.headers["Pragma"] = "no-cache"
@@ -199,15 +208,50 @@ def game_menu():
 @login_required
 def blotchville():
     """Play the Bus Game"""
-    leaders = db.execute("""
-        SELECT users.username, leaderboard.score, leaderboard.timestamp
-        FROM leaderboard
-        JOIN users ON users.id = leaderboard.user_id
-        ORDER BY score DESC
-        LIMIT 5
+    # Top games come from the small trigger-maintained leaderboard_top table
+    leaders = db.query("""
+        SELECT users.username, leaderboard_top.score, leaderboard_top.timestamp
+        FROM leaderboard_top
+        JOIN users ON users.id = leaderboard_top.user_id
+        ORDER BY leaderboard_top.score DESC, leaderboard_top.id
     """)
+    best = db.query_one("SELECT score FROM leaderboard_best WHERE user_id = ?", session["user_id"])
+    my_best = best["score"] if best else None
     # Ensure your template is named blotchville.html
-    return render_template("blotchville.html", leaders=leaders)
+    return render_template("blotchville.html", leaders=leaders, my_best=my_best)
+
+
+@app.route("/leaderboard")
+@login_required
+def leaderboard():
+    """Paged Blotchville leaderboard as JSON.
+
+    ?page=N (1-based), ?per_page=M (max 100), and ?best=1 to rank each
+    user's best score instead of every game.
+    """
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = min(max(request.args.get("per_page", 20, type=int), 1), 100)
+    offset = (page - 1) * per_page
+
+    if request.args.get("best") == "1":
+        rows = db.query("""
+            SELECT users.username, leaderboard_best.score, leaderboard_best.timestamp
+            FROM leaderboard_best
+            JOIN users ON users.id = leaderboard_best.user_id
+            ORDER BY leaderboard_best.score DESC, leaderboard_best.user_id
+            LIMIT ? OFFSET ?
+        """, per_page, offset)
+    else:
+        rows = db.query("""
+            SELECT users.username, leaderboard.score, leaderboard.timestamp
+            FROM leaderboard
+            JOIN users ON users.id = leaderboard.user_id
+            ORDER BY leaderboard.score DESC, leaderboard.id
+            LIMIT ? OFFSET ?
+        """, per_page, offset)
+
+    leaders = [{**row, "rank": rank} for rank, row in enumerate(rows, start=offset + 1)]
+    return jsonify({"page": page, "per_page": per_page, "leaders": leaders})
 
 
 @app.route("/")
@@ -315,24 +359,24 @@ def account_settings():
         if new_password != confirmation:
             return apology("New password does not match confirmation")
 
-        check_password = db.execute("SELECT hash FROM users WHERE id = ?", user_id)
+        check_password = db.query_one("SELECT hash FROM users WHERE id = ?", user_id)
         if not check_password:
             return apology("Current password not found")
-        if not check_password_hash(check_password[0]["hash"], current_password):
+        if not check_password_hash(check_password["hash"], current_password):
             return apology("Current password is incorrect")
-        if check_password_hash(check_password[0]["hash"], new_password):
+        if check_password_hash(check_password["hash"], new_password):
             return apology("New password must be different")
 
         # reset password using hash function
-        db.execute("UPDATE users SET hash = ? WHERE id = ?",
-                   generate_password_hash(new_password), user_id)
+        db.run("UPDATE users SET hash = ? WHERE id = ?",
+               generate_password_hash(new_password), user_id)
 
         return redirect("/")
 
     else:
         # Show the account settings form with current username
-        user_row = db.execute("SELECT username FROM users WHERE id = ?", user_id)
-        username = user_row[0]["username"] if user_row else ""
+        user_row = db.query_one("SELECT username FROM users WHERE id = ?", user_id)
+        username = user_row["username"] if user_row else ""
         return render_template("account_settings.html", username=username)
 
 @app.route("/study", methods=["GET", "POST"])
@@ -341,45 +385,37 @@ def study():
     user_id = session["user_id"]
 
     # For the topic dropdown: topics table now stores available topics
-    topics = problems_db.execute(
-        "SELECT id, name FROM topics ORDER BY name"
-    )
+    topics = catalog.topics()
 
     if request.method == "POST":
 
         action = request.form.get("action")          # "reveal", "right", "wrong"
         problem_id = request.form.get("problem_id")
         selected_topic = request.form.get("topic") or "Any"
+        skip_solved = bool(request.form.get("skip_solved"))
 
         if not problem_id:
             return redirect("/study")
 
         # Fetch the problem row
-        rows = problems_db.execute(
-            "SELECT id, year, problem, text, answer FROM problems WHERE id = ?",
-            problem_id,
-        )
-        if len(rows) != 1:
+        problem = catalog.get(problem_id)
+        if problem is None:
             return redirect("/study")
 
-        problem_row = rows[0]
+        problem_row = problem.as_dict()
 
         # Get topic names for this problem
-        problem_topic_rows = problems_db.execute(
-            "SELECT t.name FROM topics t JOIN problem_topics pt ON t.id = pt.topic_id WHERE pt.problem_id = ? ORDER BY t.name",
-            problem_row["id"],
-        )
-        problem_topics = [r["name"] for r in problem_topic_rows]
+        problem_topics = catalog.topic_names(problem.id)
 
         if action == "reveal":
             # Show the same problem, now with the answer visible
             # prepare cleaned fields for rendering
-            problem_row['html_text'] = _latex_to_html(problem_row.get('text'))
-            problem_row['html_answer'] = _latex_to_html(problem_row.get('answer'))
+            _attach_html(problem_row, with_answer=True)
             return render_template(
                 "study.html",
                 topics=topics,
                 selected_topic=selected_topic,
+                skip_solved=skip_solved,
                 problem=problem_row,
                 problem_topics=problem_topics,
                 show_answer=True,
@@ -389,60 +425,27 @@ def study():
         elif action in ("right", "wrong"):
             correct = 1 if action == "right" else 0
 
-            # Determine topic_id to log: prefer selected_topic if provided, else fallback to one of the problem's topics, else create/use 'Any'
-            if selected_topic != "Any":
-                tid_rows = problems_db.execute("SELECT id FROM topics WHERE name = ?", selected_topic)
-                topic_id = tid_rows[0]["id"] if tid_rows else None
-            else:
-                # try to find a topic for this problem
-                tid_rows = problems_db.execute("SELECT topic_id FROM problem_topics WHERE problem_id = ? LIMIT 1", problem_row["id"])
-                if tid_rows:
-                    topic_id = tid_rows[0]["topic_id"]
-                else:
-                    # ensure 'Any' topic exists
-                    problems_db.execute("INSERT OR IGNORE INTO topics (name) VALUES (?)", "Any")
-                    tid_rows = problems_db.execute("SELECT id FROM topics WHERE name = ?", "Any")
-                    topic_id = tid_rows[0]["id"]
-
-            problems_db.execute(
-                "INSERT INTO problem_attempts (user_id, problem_id, topic_id, correct) VALUES (?, ?, ?, ?)",
-                user_id,
-                problem_row["id"],
-                topic_id,
-                correct,
-            )
-
-            # After logging, get a new random problem (same topic filter)
-            if selected_topic == "Any":
-                probs = problems_db.execute(
-                    "SELECT id, year, problem, text, answer FROM problems ORDER BY RANDOM() LIMIT 1"
-                )
-            else:
-                probs = problems_db.execute(
-                    "SELECT p.id, p.year, p.problem, p.text, p.answer FROM problems p "
-                    "JOIN problem_topics pt ON p.id = pt.problem_id "
-                    "JOIN topics t ON pt.topic_id = t.id "
-                    "WHERE t.name = ? ORDER BY RANDOM() LIMIT 1",
-                    selected_topic,
-                )
-
-            new_problem = probs[0] if probs else None
-
-            new_problem_topics = []
+            # Topic comes from the catalog's in-memory index; the attempt is
+            # queued for the background writer (or, with immediate
+            # durability, written now, and the user is told if it failed)
+            topic_id = catalog.attempt_topic_id(selected_topic, problem.id)
+            try:
+                attempt_log.record(user_id, problem.id, topic_id, correct)
+            except (sqlite3.Error, ValueError):
+                app.logger.exception("could not log an attempt for user %s", user_id)
+                return apology("Your answer could not be saved, please try again", 503)
+
+            # After logging, get a new random problem (same topic filter),
+            # usually already rendered in the background
+            new_problem, new_problem_topics = _next_problem(user_id, selected_topic, skip_solved)
             if new_problem:
-                pt_rows = problems_db.execute(
-                    "SELECT t.name FROM topics t JOIN problem_topics pt ON t.id = pt.topic_id WHERE pt.problem_id = ? ORDER BY t.name",
-                    new_problem["id"],
-                )
-                new_problem_topics = [r["name"] for r in pt_rows]
-            if new_problem:
-                new_problem['html_text'] = _latex_to_html(new_problem.get('text'))
-                new_problem['html_answer'] = _latex_to_html(new_problem.get('answer'))
+                _prefetch_next_problem(user_id, selected_topic, skip_solved, new_problem["id"])
 
             return render_template(
                 "study.html",
                 topics=topics,
                 selected_topic=selected_topic,
+                skip_solved=skip_solved,
                 problem=new_problem,
                 problem_topics=new_problem_topics,
                 show_answer=False,
@@ -454,109 +457,101 @@ def study():
 
     # GET: either random problem or a specific one (for review)
     selected_topic = request.args.get("topic") or "Any"
+    skip_solved = bool(request.args.get("skip_solved"))
     problem_id = request.args.get("problem_id")
 
     problem_row = None
+    problem_topics = []
 
     if problem_id:
-        rows = problems_db.execute(
-            "SELECT id, year, problem, text, answer FROM problems WHERE id = ?",
-            problem_id,
-        )
-        if rows:
-            problem_row = rows[0]
+        problem = catalog.get(problem_id)
+        if problem is not None:
+            problem_row = problem.as_dict()
+            problem_topics = catalog.topic_names(problem.id)
             # Ensure dropdown matches this problem’s first topic if available
-            pt_rows = problems_db.execute(
-                "SELECT t.name FROM topics t JOIN problem_topics pt ON t.id = pt.topic_id WHERE pt.problem_id = ? ORDER BY t.name LIMIT 1",
-                problem_row["id"],
-            )
-            if pt_rows:
-                selected_topic = pt_rows[0]["name"]
+            if problem_topics:
+                selected_topic = problem_topics[0]
+            _attach_html(problem_row)
     else:
-        if selected_topic == "Any":
-            probs = problems_db.execute(
-                "SELECT id, year, problem, text, answer FROM problems ORDER BY RANDOM() LIMIT 1"
-            )
-        else:
-            probs = problems_db.execute(
-                "SELECT p.id, p.year, p.problem, p.text, p.answer FROM problems p "
-                "JOIN problem_topics pt ON p.id = pt.problem_id "
-                "JOIN topics t ON pt.topic_id = t.id "
-                "WHERE t.name = ? ORDER BY RANDOM() LIMIT 1",
-                selected_topic,
-            )
-        problem_row = probs[0] if probs else None
+        problem_row, problem_topics = _next_problem(user_id, selected_topic, skip_solved)
 
-    # If we have a problem, fetch its topic names
-    problem_topics = []
-    if problem_row:
-        pt_rows = problems_db.execute(
-            "SELECT t.name FROM topics t JOIN problem_topics pt ON t.id = pt.topic_id WHERE pt.problem_id = ? ORDER BY t.name",
-            problem_row["id"],
-        )
-        problem_topics = [r["name"] for r in pt_rows]
     if problem_row:
-        problem_row['html_text'] = _latex_to_html(problem_row.get('text'))
-        problem_row['html_answer'] = _latex_to_html(problem_row.get('answer'))
+        _prefetch_next_problem(user_id, selected_topic, skip_solved, problem_row["id"])
 
-    return render_template(
+    page = render_template(
         "study.html",
         topics=topics,
         selected_topic=selected_topic,
+        skip_solved=skip_solved,
         problem=problem_row,
         problem_topics=problem_topics,
         show_answer=False,
         feedback=None,
     )
+    if not (problem_id and problem_row):
+        return page
+
+    # A specific problem (review links from /progress) renders the same page
+    # every time: tag it so the browser can revalidate instead of refetching
+    response = make_response(page)
+    response.add_etag()
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
 
 @app.route("/progress")
 @login_required
 def progress():
     user_id = session["user_id"]
 
-    # Per-topic stats
-    stats = problems_db.execute(
+    # make sure this user's latest answers are in the table before counting
+    if attempt_log.pending_for(user_id):
+        attempt_log.flush(timeout=5)
+
+    # Per-topic stats (topic names come from the in-memory catalog)
+    stats = []
+    for row in attempts_db.query(
         """
         SELECT
-            t.name AS topic,
-            SUM(CASE WHEN a.correct = 1 THEN 1 ELSE 0 END) AS correct_count,
-            SUM(CASE WHEN a.correct = 0 THEN 1 ELSE 0 END) AS wrong_count,
+            topic_id,
+            SUM(CASE WHEN correct = 1 THEN 1 ELSE 0 END) AS correct_count,
+            SUM(CASE WHEN correct = 0 THEN 1 ELSE 0 END) AS wrong_count,
             COUNT(*) AS total
-        FROM problem_attempts a
-        JOIN topics t ON a.topic_id = t.id
-        WHERE a.user_id = ?
-        GROUP BY t.name
-        ORDER BY t.name;
+        FROM problem_attempts
+        WHERE user_id = ?
+        GROUP BY topic_id;
         """,
         user_id,
-    )
-
-    # Problems user has gotten wrong at least once
-    wrong_problems = problems_db.execute(
+    ):
+        name = catalog.topic_name(row["topic_id"])
+        if name is not None:
+            stats.append({**row, "topic": name})
+    stats.sort(key=lambda r: r["topic"])
+
+    # Problems user has gotten wrong at least once; their details and topic
+    # names come from the catalog rather than one query per problem
+    wrong_problems = []
+    for row in attempts_db.query(
         """
-        SELECT
-            p.id,
-            p.year,
-            p.problem,
-            p.answer,
-            MAX(a.attempted_at) AS last_attempt
-        FROM problem_attempts a
-        JOIN problems p ON a.problem_id = p.id
-        WHERE a.user_id = ? AND a.correct = 0
-        GROUP BY p.id
+        SELECT problem_id, MAX(attempted_at) AS last_attempt
+        FROM problem_attempts
+        WHERE user_id = ? AND correct = 0
+        GROUP BY problem_id
         ORDER BY last_attempt DESC
         LIMIT 50;
         """,
         user_id,
-    )
-
-    # For each wrong problem, fetch all topic names it is linked to so the UI can show them
-    for p in wrong_problems:
-        pt_rows = problems_db.execute(
-            "SELECT t.name FROM topics t JOIN problem_topics pt ON t.id = pt.topic_id WHERE pt.problem_id = ? ORDER BY t.name",
-            p["id"],
-        )
-        p["topics"] = [r["name"] for r in pt_rows]
+    ):
+        problem = catalog.get(row["problem_id"])
+        if problem is None:
+            continue
+        wrong_problems.append({
+            "id": problem.id,
+            "year": problem.year,
+            "problem": problem.problem,
+            "answer": problem.answer,
+            "last_attempt": row["last_attempt"],
+            "topics": catalog.topic_names(problem.id),
+        })
 
     return render_template("progress.html", stats=stats, wrong_problems=wrong_problems)
 
@@ -573,33 +568,50 @@ def submit_score():
     
     if score is not None:
         # Save score to users.db
-        db.execute("INSERT INTO leaderboard (user_id, score) VALUES (?, ?)", 
-                   session["user_id"], score)
+        db.run("INSERT INTO leaderboard (user_id, score) VALUES (?, ?)",
+               session["user_id"], score)
         return jsonify({"success": True})
     
     return jsonify({"success": False}), 400
 
 
+@app.route("/submit_scores", methods=["POST"])
+@login_required
+def submit_scores():
+    """Save a batch of Blotchville scores buffered by the browser"""
+    # force: sendBeacon posts the JSON as text/plain
+    data = request.get_json(force=True, silent=True) or {}
+    scores = data.get("scores")
+    if not isinstance(scores, list) or not scores or len(scores) > MAX_BATCH:
+        return jsonify({"success": False}), 400
+
+    user_id = session["user_id"]
+    rows = []
+    for score in scores:
+        if isinstance(score, bool) or not isinstance(score, (int, float)):
+            return jsonify({"success": False}), 400
+        rows.append((user_id, int(score)))
+
+    _insert_rows(db, "INSERT INTO leaderboard (user_id, score)", rows)
+    return jsonify({"success": True, "saved": len(rows)})
+
+
 @app.route("/monty_hall")
 @login_required
 def monty_hall():
     """Play the Monty Hall Game"""
     user_id = session["user_id"]
 
-    # Calculate stats for the user
-    # 1. Stats for SWITCHING
-    switch_attempts = db.execute("SELECT COUNT(*) as n FROM monty_stats WHERE user_id = ? AND switched = 1", user_id)[0]["n"]
-    switch_wins = db.execute("SELECT COUNT(*) as n FROM monty_stats WHERE user_id = ? AND switched = 1 AND won = 1", user_id)[0]["n"]
-    
-    # 2. Stats for STAYING
-    stay_attempts = db.execute("SELECT COUNT(*) as n FROM monty_stats WHERE user_id = ? AND switched = 0", user_id)[0]["n"]
-    stay_wins = db.execute("SELECT COUNT(*) as n FROM monty_stats WHERE user_id = ? AND switched = 0 AND won = 1", user_id)[0]["n"]
-
-    stats = {
-        "switch_attempts": switch_attempts,
-        "switch_wins": switch_wins,
-        "stay_attempts": stay_attempts,
-        "stay_wins": stay_wins
+    # Calculate stats for the user: counters are maintained by triggers on
+    # monty_stats (see migrations.py), so this is one primary-key lookup
+    stats = db.query_one(
+        "SELECT switch_attempts, switch_wins, stay_attempts, stay_wins FROM monty_totals WHERE user_id = ?",
+        user_id,
+    ) or {
+        "switch_attempts": 0,
+        "switch_wins": 0,
+        "stay_attempts": 0,
+        "stay_wins": 0,
     }
 
     return render_template("monty_hall.html", stats=stats)
@@ -612,74 +624,126 @@ def monty_save():
     switched = 1 if data.get("switched") else 0
     won = 1 if data.get("won") else 0
     
-    db.execute("INSERT INTO monty_stats (user_id, switched, won) VALUES (?, ?, ?)",
-               session["user_id"], switched, won)
+    db.run("INSERT INTO monty_stats (user_id, switched, won) VALUES (?, ?, ?)",
+           session["user_id"], switched, won)
     
     return jsonify({"success": True})
 
+@app.route("/monty_save_batch", methods=["POST"])
+@login_required
+def monty_save_batch():
+    """Save a batch of Monty Hall results buffered by the browser"""
+    # force: sendBeacon posts the JSON as text/plain
+    data = request.get_json(force=True, silent=True) or {}
+    results = data.get("results")
+    if not isinstance(results, list) or not results or len(results) > MAX_BATCH:
+        return jsonify({"success": False}), 400
+
+    user_id = session["user_id"]
+    rows = []
+    for result in results:
+        if not isinstance(result, dict):
+            return jsonify({"success": False}), 400
+        rows.append((user_id, 1 if result.get("switched") else 0, 1 if result.get("won") else 0))
+
+    _insert_rows(db, "INSERT INTO monty_stats (user_id, switched, won)", rows)
+    return jsonify({"success": True, "saved": len(rows)})
+
 @app.route("/wandering_professor")
 @login_required
 def wandering_professor():
     """Play the Random Walk Game"""
     return render_template("wandering_professor.html")
 
+# The official list of cafes
+CAFES = [
+    "Blank Street", "LA Burdick", "Peet's Coffee", "Simon's Coffee",
+    "Pavement", "JP Licks", "Tatte", "Starbucks", "Flour",
+    "Cafe Gato Rojo", "Blue Bottle", "Faro Cafe",
+    "Kung Fu Tea", "Ten One Tea House", "Gong Cha", "Other"
+]
+
+CAFE_CATEGORIES = {
+    "hot_chocolate": "🍫 Hot Chocolate",
+    "coffee": "☕ Coffee",
+    "tea": "🍵 Tea"
+}
+
+# Poll results are served from an in-process snapshot. A vote cast through
+# this process drops it right away; votes cast through other workers show up
+# once it is older than CAFE_RESULTS_TTL seconds.
+CAFE_RESULTS_TTL = float(os.environ.get("CAFE_RESULTS_TTL", "5"))
+_CAFE_RESULTS: tuple[float, list[dict]] | None = None
+_CAFE_RESULTS_LOCK = threading.Lock()
+
+
+def _cafe_results() -> list[dict]:
+    """Return the poll percentages per category, built from cafe_tallies."""
+    global _CAFE_RESULTS
+    snapshot = _CAFE_RESULTS
+    if snapshot is not None and time.monotonic() - snapshot[0] < CAFE_RESULTS_TTL:
+        return snapshot[1]
+
+    with _CAFE_RESULTS_LOCK:
+        snapshot = _CAFE_RESULTS
+        if snapshot is not None and time.monotonic() - snapshot[0] < CAFE_RESULTS_TTL:
+            return snapshot[1]
+
+        loaded_at = time.monotonic()
+        # Counters are maintained by triggers on cafe_votes (see migrations.py)
+        results = {slug: {} for slug in CAFE_CATEGORIES}
+        for row in db.query("SELECT category, cafe, votes FROM cafe_tallies WHERE votes > 0"):
+            if row["category"] in results and row["cafe"] in CAFES:
+                results[row["category"]][row["cafe"]] = row["votes"]
+
+        final_data = []
+        for slug, label in CAFE_CATEGORIES.items():
+            counts = results[slug]
+            total_votes = sum(counts.values())
+            cafe_list = [
+                {"name": cafe, "pct": counts[cafe] / total_votes * 100}
+                for cafe in CAFES if cafe in counts
+            ]
+            cafe_list.sort(key=lambda x: x["pct"], reverse=True)
+            final_data.append({"label": label, "slug": slug, "cafes": cafe_list})
+
+        _CAFE_RESULTS = (loaded_at, final_data)
+        return final_data
+
+
+def _invalidate_cafe_results() -> None:
+    """Drop the poll snapshot so the next page view sees the latest votes."""
+    global _CAFE_RESULTS
+    with _CAFE_RESULTS_LOCK:
+        _CAFE_RESULTS = None
+
+
 @app.route("/cafe_poll", methods=["GET", "POST"])
 @login_required
 def cafe_poll():
-    # The official list of cafes
-    cafes = [
-        "Blank Street", "LA Burdick", "Peet's Coffee", "Simon's Coffee", 
-        "Pavement", "JP Licks", "Tatte", "Starbucks", "Flour", 
-        "Cafe Gato Rojo", "Blue Bottle", "Faro Cafe",
-        "Kung Fu Tea", "Ten One Tea House", "Gong Cha", "Other"
-    ]
-    
-    categories = {
-        "hot_chocolate": "🍫 Hot Chocolate",
-        "coffee": "☕ Coffee",
-        "tea": "🍵 Tea"
-    }
-
     if request.method == "POST":
-        for cat_slug in categories.keys():
+        rows = []
+        for cat_slug in CAFE_CATEGORIES.keys():
             choice = request.form.get(cat_slug)
-            if choice and choice in cafes:
-                db.execute("""
-                    INSERT OR REPLACE INTO cafe_votes (user_id, category, cafe) 
-                    VALUES (?, ?, ?)
-                """, session["user_id"], cat_slug, choice)
-    
+            if choice and choice in CAFES:
+                rows.append((session["user_id"], cat_slug, choice))
+
+        if rows:
+            # One transaction, so all of the user's votes (and the tallies
+            # the triggers adjust) are committed together
+            _insert_rows(db, "INSERT OR REPLACE INTO cafe_votes (user_id, category, cafe)", rows)
+            _invalidate_cafe_results()
+
         return redirect("/cafe_poll")
 
     # --- GET: Calculate Results ---
-    
-    # 1. Get GLOBAL results for the progress bars
-    results = {slug: {cafe: 0 for cafe in cafes} for slug in categories.keys()}
-    totals = {slug: 0 for slug in categories.keys()}
-
-    rows = db.execute("SELECT category, cafe, COUNT(*) as count FROM cafe_votes GROUP BY category, cafe")
-    for row in rows:
-        cat = row["category"]
-        cafe = row["cafe"]
-        count = row["count"]
-        if cat in results and cafe in results[cat]:
-            results[cat][cafe] = count
-            totals[cat] += count
-
-    final_data = []
-    for slug, label in categories.items():
-        cafe_list = []
-        total_votes = totals[slug]
-        for cafe, count in results[slug].items():
-            if count > 0: 
-                pct = (count / total_votes * 100) if total_votes > 0 else 0
-                cafe_list.append({"name": cafe, "pct": pct})
-        cafe_list.sort(key=lambda x: x["pct"], reverse=True)
-        final_data.append({"label": label, "slug": slug, "cafes": cafe_list})
+
+    # 1. GLOBAL results for the progress bars (shared snapshot)
+    final_data = _cafe_results()
 
     # 2. Get CURRENT USER'S votes to display specifically to them
-    user_votes_rows = db.execute("SELECT category, cafe FROM cafe_votes WHERE user_id = ?", session["user_id"])
+    user_votes_rows = db.query("SELECT category, cafe FROM cafe_votes WHERE user_id = ?", session["user_id"])
     # Convert list of rows to a dictionary: {'coffee': 'Tatte', 'tea': 'Gong Cha'}
     user_votes = {row["category"]: row["cafe"] for row in user_votes_rows}
 
-    return render_template("cafe_votes.html", cafes=cafes, poll_results=final_data, user_votes=user_votes)
\ No newline at end of file
+    return render_template("cafe_votes.html", cafes=CAFES, poll_results=final_data, user_votes=user_votes)
\ No newline at end of file
@@ -0,0 +1,213 @@
+"""
+Write-behind log of /study answers ("right"/"wrong") for problem_attempts.
+
+Answering a problem only appends the attempt to an in-memory buffer. A
+background writer thread drains the buffer in batches, one transaction
+(and one fsync) per batch, so the request that logs the answer never waits
+on the disk. Pending attempts are visible to `pending_for()` until they are
+written, so a user's own progress still reflects them, and `flush()` waits
+for everything logged so far to reach the database.
+
+Durability is a tradeoff, set with ATTEMPT_DURABILITY:
+- "buffered" (default): write-behind as above. The buffer is flushed at
+  interpreter shutdown, but a hard crash can lose the last
+  ATTEMPT_FLUSH_INTERVAL seconds of answers. If the database can't be
+  written (locked, disk full), attempts stay buffered and the writer
+  retries with a growing delay, up to ATTEMPT_RETRY_MAX seconds.
+- "immediate": every attempt is written before the request returns, and a
+  failed write raises to the caller.
+
+Only attempts the database rejects outright (a constraint violation, which
+no retry can fix) are dropped, and they are logged. The writer thread is
+started by the first buffered record(), so each worker process gets its
+own.
+"""
+
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from database import Database
+
+ATTEMPT_DURABILITY = os.environ.get("ATTEMPT_DURABILITY", "buffered").lower()
+ATTEMPT_FLUSH_INTERVAL = float(os.environ.get("ATTEMPT_FLUSH_INTERVAL", "0.5"))
+ATTEMPT_BATCH_SIZE = int(os.environ.get("ATTEMPT_BATCH_SIZE", "200"))
+ATTEMPT_RETRY_MAX = float(os.environ.get("ATTEMPT_RETRY_MAX", "30"))
+
+DURABILITY_LEVELS = ("buffered", "immediate")
+
+INSERT_SQL = (
+    "INSERT INTO problem_attempts (user_id, problem_id, topic_id, correct, attempted_at) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Attempt(NamedTuple):
+    user_id: int
+    problem_id: int
+    topic_id: int
+    correct: int
+    attempted_at: str  # UTC, same format as SQLite's CURRENT_TIMESTAMP
+
+
+class AttemptLog:
+    """Buffer problem attempts in memory and write them in batches."""
+
+    def __init__(self, database: Database, durability: str = ATTEMPT_DURABILITY,
+                 flush_interval: float = ATTEMPT_FLUSH_INTERVAL, batch_size: int = ATTEMPT_BATCH_SIZE):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"unknown attempt durability: {durability}")
+        self.database = database
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+
+        # Attempts not yet written, oldest first. Only the writer removes
+        # from the front; record() appends at the back.
+        self._pending: list[Attempt] = []
+        self._cond = threading.Condition()
+        self._logged = 0   # attempts ever recorded
+        self._written = 0  # attempts ever written (or rejected by the database)
+        self._flush_requested = False
+        self._closed = False
+        # Started by the first record(), in the process that serves requests:
+        # a thread started at import time would not survive a fork (e.g.
+        # gunicorn --preload)
+        self._thread: threading.Thread | None = None
+
+    def record(self, user_id: int, problem_id: int, topic_id: int, correct: bool) -> None:
+        """Log one answer.
+
+        Without the background writer (immediate durability, or after
+        close()) the attempt is written here, and sqlite3.Error (ValueError
+        if the database rejects the row) is raised if that fails.
+        """
+        attempt = Attempt(
+            user_id, problem_id, topic_id, 1 if correct else 0,
+            datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        )
+        if self.durability == "immediate" or self._closed:
+            with self.database.transaction():
+                self.database.run(INSERT_SQL, *attempt)
+            return
+        with self._cond:
+            self._start_writer()
+            self._pending.append(attempt)
+            self._logged += 1
+            self._cond.notify_all()
+
+    def pending_for(self, user_id: int) -> list[Attempt]:
+        """Attempts by `user_id` that are not in the database yet."""
+        with self._cond:
+            return [a for a in self._pending if a.user_id == user_id]
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until every attempt recorded so far has been written.
+
+        Returns False if `timeout` seconds pass first.
+        """
+        if self._thread is None:
+            return True
+        with self._cond:
+            target = self._logged
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._written >= target, timeout)
+
+    def close(self) -> None:
+        """Write everything still buffered and stop the writer."""
+        if self._thread is None or self._closed:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _start_writer(self) -> None:
+        """Start the writer thread if this process doesn't have a live one. Call with _cond held."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if self._thread is None:
+            atexit.register(self.close)
+        self._thread = threading.Thread(target=self._run, name="attempt-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        retry_delay = self.flush_interval
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return  # closed and drained
+
+                # give a burst of answers a moment to pile up into one batch
+                deadline = time.monotonic() + self.flush_interval
+                while (len(self._pending) < self.batch_size
+                       and not self._flush_requested and not self._closed):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                batch = self._pending[:self.batch_size]
+
+            try:
+                done = self._write(batch)
+            except Exception:
+                # never let an unexpected error stop the writer; retry later
+                logger.exception("attempt log: writing a batch of %d failed", len(batch))
+                done = 0
+
+            with self._cond:
+                del self._pending[:done]
+                self._written += done
+                if not self._pending:
+                    self._flush_requested = False
+                self._cond.notify_all()
+                if done == len(batch):
+                    retry_delay = self.flush_interval
+                    continue
+                if self._closed:
+                    logger.error("attempt log: shutting down with %d attempts that could not be written: %s",
+                                 len(self._pending), self._pending)
+                    return
+                # keep the attempts and back off before trying again
+                logger.warning("attempt log: %d attempts waiting, retrying in %.1fs",
+                               len(self._pending), retry_delay)
+                self._cond.wait_for(lambda: self._closed, retry_delay)
+                retry_delay = min(retry_delay * 2, ATTEMPT_RETRY_MAX)
+
+    def _write(self, batch: list[Attempt]) -> int:
+        """Write a batch in one transaction, falling back to row by row.
+
+        Returns how many attempts from the front of the batch are done with:
+        written, or rejected by the database as invalid. Stops at the first
+        attempt that fails for any other reason; the caller keeps that one
+        and the rest for a retry.
+        """
+        if len(batch) > 1:
+            try:
+                with self.database.transaction():
+                    self.database.run_many(INSERT_SQL, batch)
+                return len(batch)
+            except (sqlite3.Error, ValueError) as e:
+                logger.warning("attempt log: batch of %d failed (%s), retrying one by one", len(batch), e)
+
+        for done, attempt in enumerate(batch):
+            try:
+                with self.database.transaction():
+                    self.database.run(INSERT_SQL, *attempt)
+            except ValueError:
+                # Database.run reports constraint violations as ValueError
+                logger.exception("attempt log: the database rejected %s, dropping it", attempt)
+            except sqlite3.Error:
+                logger.exception("attempt log: could not write %s", attempt)
+                return done
+        return len(batch)
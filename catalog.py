@@ -0,0 +1,260 @@
+"""
+In-memory, read-only catalog of the problem bank in problems.db.
+
+Problems, topics and the problem -> topics mapping are static between
+imports, so they are loaded once into compact records and served from
+memory. The importer stamps a new `bank_meta.version` every time it rewrites
+the bank; the catalog reloads when that stamp changes. To keep the check
+cheap it only looks at the stamp when the mtime of the database file or its
+WAL file has moved, or the path now points at a different file (the importer
+publishes a rebuilt bank by repointing the problems.db symlink), and it stats
+those files at most once every CATALOG_CHECK_INTERVAL seconds rather than on
+every call. Reloads build a complete new snapshot and swap it in with one
+assignment, so readers never see a half-loaded bank.
+
+Reloads read through the app's read-only, memory-mapped problems_db
+connection (see database.py), which reopens itself when the importer has
+swapped in a new file.
+"""
+
+import array
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from database import Database
+
+BANK_VERSION_KEY = "version"
+
+# How often (seconds) the catalog looks at the file for a new bank
+CATALOG_CHECK_INTERVAL = float(os.environ.get("CATALOG_CHECK_INTERVAL", "1"))
+
+# Name of the catch-all topic: selects every problem on /study, and is the
+# topic attempts are logged under when nothing more specific applies
+ANY_TOPIC = "Any"
+
+
+def read_bank_version(conn: sqlite3.Connection) -> str | None:
+    """Return the problem bank version stamped by the importer, if any."""
+    try:
+        row = conn.execute(
+            "SELECT value FROM bank_meta WHERE key = ?", (BANK_VERSION_KEY,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # bank imported before versioning existed
+        return None
+    return row[0] if row else None
+
+
+class Problem:
+    """One row of `problems`, plus the ids of the topics it is tagged with."""
+
+    __slots__ = ("id", "year", "problem", "text", "answer",
+                 "html_text", "html_answer", "html_hash", "topic_ids")
+
+    def __init__(self, id, year, problem, text, answer, html_text, html_answer, html_hash):
+        self.id = id
+        self.year = year
+        self.problem = problem
+        self.text = text
+        self.answer = answer
+        self.html_text = html_text
+        self.html_answer = html_answer
+        self.html_hash = html_hash
+        self.topic_ids: tuple[int, ...] = ()
+
+    def as_dict(self) -> dict:
+        """Return a fresh, mutable copy of the row (for templates and rendering)."""
+        return {
+            "id": self.id,
+            "year": self.year,
+            "problem": self.problem,
+            "text": self.text,
+            "answer": self.answer,
+            "html_text": self.html_text,
+            "html_answer": self.html_answer,
+            "html_hash": self.html_hash,
+        }
+
+
+class Topic:
+    """One row of `topics`."""
+
+    __slots__ = ("id", "name")
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class _Snapshot:
+    """Everything loaded from one version of the bank."""
+
+    __slots__ = ("version", "problems", "topics", "topics_by_id", "topic_ids_by_name",
+                 "all_ids", "ids_by_topic")
+
+    def __init__(self, conn: sqlite3.Connection, version: str | None):
+        self.version = version
+
+        self.problems: dict[int, Problem] = {
+            row[0]: Problem(*row)
+            for row in conn.execute(
+                "SELECT id, year, problem, text, answer, html_text, html_answer, html_hash "
+                "FROM problems ORDER BY id"
+            )
+        }
+        all_topics = [Topic(*row) for row in conn.execute("SELECT id, name FROM topics ORDER BY name")]
+        # the dropdown offers "Any" itself, so leave the catch-all row out
+        self.topics: tuple[Topic, ...] = tuple(t for t in all_topics if t.name != ANY_TOPIC)
+        self.topics_by_id: dict[int, Topic] = {t.id: t for t in all_topics}
+        self.topic_ids_by_name: dict[str, int] = {t.name: t.id for t in all_topics}
+
+        topic_ids: dict[int, list[int]] = {}
+        ids_by_topic: dict[str, array.array] = {}
+        for problem_id, topic_id in conn.execute(
+            "SELECT problem_id, topic_id FROM problem_topics ORDER BY problem_id, topic_id"
+        ):
+            topic = self.topics_by_id.get(topic_id)
+            if problem_id not in self.problems or topic is None:
+                continue
+            topic_ids.setdefault(problem_id, []).append(topic_id)
+            ids_by_topic.setdefault(topic.name, array.array("q")).append(problem_id)
+        for problem_id, ids in topic_ids.items():
+            self.problems[problem_id].topic_ids = tuple(ids)
+
+        self.all_ids = array.array("q", self.problems)
+        self.ids_by_topic = ids_by_topic
+
+
+class ProblemCatalog:
+    """Read-only view of problems, topics and problem_topics, kept in memory."""
+
+    ANY = ANY_TOPIC
+    # rejection-sampling attempts before falling back to filtering the ids
+    MAX_TRIES = 16
+
+    def __init__(self, database: Database, check_interval: float = CATALOG_CHECK_INTERVAL):
+        self.database = database
+        self.db_path = database.path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot: _Snapshot | None = None
+        self._mtime: tuple | None = None
+        self._next_check = 0.0
+
+    def topics(self) -> tuple[Topic, ...]:
+        """All topics except "Any", sorted by name."""
+        return self._current().topics
+
+    def get(self, problem_id) -> Problem | None:
+        """Look up a problem by id (accepts the string ids that forms submit)."""
+        try:
+            return self._current().problems.get(int(problem_id))
+        except (TypeError, ValueError):
+            return None
+
+    def topic_names(self, problem_id: int) -> list[str]:
+        """Sorted names of the topics a problem is tagged with."""
+        snap = self._current()
+        problem = snap.problems.get(problem_id)
+        if problem is None:
+            return []
+        return sorted(snap.topics_by_id[tid].name for tid in problem.topic_ids)
+
+    def topic_name(self, topic_id: int) -> str | None:
+        """Name of a topic by id, or None if it isn't in the bank."""
+        topic = self._current().topics_by_id.get(topic_id)
+        return topic.name if topic else None
+
+    def attempt_topic_id(self, topic: str, problem_id: int) -> int | None:
+        """Topic id to log an attempt at `problem_id` under.
+
+        The topic selected on /study if it exists, else the problem's first
+        topic, else the "Any" topic (created by the schema migrations).
+        """
+        snap = self._current()
+        if topic != self.ANY and topic in snap.topic_ids_by_name:
+            return snap.topic_ids_by_name[topic]
+        problem = snap.problems.get(problem_id)
+        if problem is not None and problem.topic_ids:
+            return problem.topic_ids[0]
+        return snap.topic_ids_by_name.get(self.ANY)
+
+    def sample(self, topic: str, exclude: set[int] | frozenset = frozenset()) -> int | None:
+        """Return a random problem id for `topic` ("Any" for all problems).
+
+        Ids in `exclude` (e.g. problems the user already got right) are
+        skipped. Returns None if no eligible problem exists.
+        """
+        snap = self._current()
+        ids = snap.all_ids if topic == self.ANY else snap.ids_by_topic.get(topic)
+        if not ids:
+            return None
+
+        if not exclude:
+            return ids[random.randrange(len(ids))]
+
+        for _ in range(self.MAX_TRIES):
+            pid = ids[random.randrange(len(ids))]
+            if pid not in exclude:
+                return pid
+
+        # most of the topic is excluded: pick from what's left
+        remaining = [pid for pid in ids if pid not in exclude]
+        return random.choice(remaining) if remaining else None
+
+    def invalidate(self) -> None:
+        """Force a reload on next use (e.g. after the importer has run)."""
+        with self._lock:
+            self._snapshot = None
+            self._mtime = None
+
+    def _file_state(self) -> tuple:
+        """Identity of the database file plus its and its WAL file's mtimes.
+
+        In WAL mode a commit only touches the -wal file until the next
+        checkpoint, so both are watched. SQLite names the WAL after the
+        file a symlink points to, so that is where it is looked for.
+        """
+        try:
+            st = os.stat(self.db_path)
+        except OSError:
+            return (None, None, None)
+        if os.path.islink(self.db_path):
+            wal_path = os.path.realpath(self.db_path) + "-wal"
+        else:
+            wal_path = self.db_path + "-wal"
+        try:
+            wal_mtime = os.stat(wal_path).st_mtime_ns
+        except OSError:
+            wal_mtime = None
+        return (st.st_ino, st.st_mtime_ns, wal_mtime)
+
+    def _current(self) -> _Snapshot:
+        snap = self._snapshot
+        now = time.monotonic()
+        if snap is not None and now < self._next_check:
+            return snap
+
+        mtime = self._file_state()
+        self._next_check = now + self.check_interval
+        if snap is not None and mtime == self._mtime:
+            return snap
+
+        with self._lock:
+            if self._snapshot is not None and mtime == self._mtime:
+                return self._snapshot
+
+            conn = self.database.connection()
+            # one read transaction, so the stamp and the rows agree
+            conn.execute("BEGIN")
+            try:
+                version = read_bank_version(conn)
+                if self._snapshot is None or version != self._snapshot.version:
+                    self._snapshot = _Snapshot(conn, version)
+            finally:
+                conn.execute("COMMIT")
+            self._mtime = mtime
+            return self._snapshot
@@ -0,0 +1,198 @@
+"""
+SQLite access layer for users.db, attempts.db and problems.db.
+
+Each thread gets its own long-lived connection to each database, opened on
+first use and reused by every request that thread serves. Connections are
+put in WAL mode, so readers are not blocked by a writer, and wait on
+`busy_timeout` instead of failing with "database is locked" when another
+process holds the write lock. Statements go through sqlite3's per-connection
+statement cache, so hot queries are only prepared once per thread.
+
+`Database.execute` keeps the calling convention of cs50's `SQL.execute`
+that the routes were written against. Queries return a list of dicts,
+INSERT returns the new row id, and other statements return the number of
+rows changed. Constraint violations raise ValueError.
+
+Hot routes use the thinner calls, which skip the statement sniffing and the
+dict building. `query` and `query_one` return `sqlite3.Row` objects, which
+support `row["col"]` and `{{ row.col }}` in templates. `run` and `run_many`
+return the cursor. `transaction()` groups several statements into one
+commit.
+
+With `follow_swaps=True` a connection is reopened when the file at `path`
+is replaced, e.g. when the importer publishes a new problem bank by
+repointing the problems.db symlink. The file's identity is checked each
+time a connection is handed out, and again once a write transaction holds
+the lock, so a writer that waited out a swap does not commit into the
+retired file.
+
+`readonly=True` opens the file with `mode=ro` and leaves its journal mode
+alone. That is how the app opens the problem bank, which only the importer
+writes. `mmap_size` lets SQLite read pages through a memory map instead of
+read() calls, so every process reading the same file shares the OS page
+cache.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+# Tunables (see README): durability level, how long to wait for the write
+# lock in milliseconds, and how many prepared statements each connection keeps
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL").upper()
+DB_BUSY_TIMEOUT = int(os.environ.get("DB_BUSY_TIMEOUT", "5000"))
+DB_STATEMENT_CACHE = int(os.environ.get("DB_STATEMENT_CACHE", "256"))
+# bytes of a read-only database to memory-map (0 turns mmap off)
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+_SYNCHRONOUS_LEVELS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+class Database:
+    """Per-thread connections to one SQLite file."""
+
+    def __init__(self, path: str, synchronous: str = DB_SYNCHRONOUS,
+                 busy_timeout: int = DB_BUSY_TIMEOUT, cached_statements: int = DB_STATEMENT_CACHE,
+                 follow_swaps: bool = False, readonly: bool = False, mmap_size: int = 0):
+        if synchronous not in _SYNCHRONOUS_LEVELS:
+            raise ValueError(f"unknown synchronous level: {synchronous}")
+        self.path = path
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.follow_swaps = follow_swaps
+        self.readonly = readonly
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self.follow_swaps and not conn.in_transaction and self._swapped():
+            self.close()
+            conn = None
+        if conn is None:
+            # identify the file before opening it: if it is swapped in
+            # between, the next check reopens rather than missing the swap
+            self._local.file_id = _file_id(self.path)
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _swapped(self) -> bool:
+        """True if `path` now names a different file than this thread has open."""
+        return _file_id(self.path) != getattr(self._local, "file_id", None)
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: autocommit, each statement is its own
+        # transaction unless the caller issues BEGIN. `timeout` sets the
+        # connection's busy_timeout.
+        conn = sqlite3.connect(
+            f"file:{pathname2url(os.path.abspath(self.path))}?mode=ro" if self.readonly else self.path,
+            timeout=self.busy_timeout / 1000,
+            isolation_level=None,
+            cached_statements=self.cached_statements,
+            uri=self.readonly,
+        )
+        if self.mmap_size:
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        if self.readonly:
+            return conn
+        conn.execute("PRAGMA journal_mode = WAL")
+        # PRAGMA arguments can't be bound parameters; the level is validated above
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        # cs50's SQL enforced foreign keys, keep doing so
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def execute(self, sql: str, *args):
+        """Run one statement with positional `?` parameters.
+
+        Returns a list of dicts for statements that produce rows, the new
+        row id for INSERT/REPLACE and the number of changed rows otherwise.
+        """
+        cursor = self.run(sql, *args)
+
+        if cursor.description is not None:
+            columns = [d[0] for d in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        verb = sql.lstrip().split(None, 1)[0].upper()
+        if verb in ("INSERT", "REPLACE"):
+            return cursor.lastrowid
+        return cursor.rowcount
+
+    def query(self, sql: str, *args) -> list[sqlite3.Row]:
+        """Run a query and return all of its rows."""
+        cursor = self.connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute(sql, args).fetchall()
+
+    def query_one(self, sql: str, *args) -> sqlite3.Row | None:
+        """Run a query and return its first row, or None."""
+        cursor = self.connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute(sql, args).fetchone()
+
+    def run(self, sql: str, *args) -> sqlite3.Cursor:
+        """Run one statement and return the cursor (for lastrowid/rowcount)."""
+        try:
+            return self.connection().execute(sql, args)
+        except sqlite3.IntegrityError as e:
+            raise ValueError(str(e)) from e
+
+    def run_many(self, sql: str, rows) -> sqlite3.Cursor:
+        """Run one statement once per parameter tuple in `rows`.
+
+        The statement is prepared once. Wrap the call in `transaction()` to
+        commit all rows together.
+        """
+        try:
+            return self.connection().executemany(sql, rows)
+        except sqlite3.IntegrityError as e:
+            raise ValueError(str(e)) from e
+
+    @contextmanager
+    def transaction(self, immediate: bool = True):
+        """Run the enclosed statements in one transaction on this thread.
+
+        Commits on success and rolls back on error. `immediate` takes the
+        write lock up front (waiting up to busy_timeout), so a transaction
+        that writes can't fail halfway with "database is locked". A
+        transaction opened inside another one joins the outer one.
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            yield self
+            return
+
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        while immediate and self.follow_swaps and self._swapped():
+            # the file was swapped while we waited for the lock
+            conn.execute("ROLLBACK")
+            conn = self.connection()
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self) -> None:
+        """Close this thread's connection (it is reopened on next use)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _file_id(path: str) -> tuple[int, int] | None:
+    """(device, inode) of the file `path` resolves to, or None if it is missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
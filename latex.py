@@ -0,0 +1,337 @@
+"""
+Server-side LaTeX -> HTML rendering pipeline.
+
+clean_latex_text -> Pandoc -> rewrite_image_paths, shared by the Flask app
+(on demand, behind the render cache) and scripts/import_problems.py (which
+precompiles every problem into problems.db at import time).
+"""
+
+import os
+import re
+import subprocess
+import threading
+import uuid
+
+from pandoc_pool import PandocPool
+from render_cache import RenderCache, render_key
+
+# Optional: use pypandoc if available; otherwise fall back to calling pandoc binary
+try:
+    import pypandoc  # type: ignore
+except Exception:
+    pypandoc = None
+
+# Path to your macros file (adjust if needed)
+MACROS_PATH = os.path.join(os.path.dirname(__file__), "static", "macros.tex")
+_LATEX_MACROS_CACHE: str | None = None
+_PANDOC_VERSION_CACHE: str | None = None
+
+# Rendered HTML cache: in-process LRU backed by a SQLite file that survives restarts
+RENDER_CACHE_PATH = os.environ.get(
+    "RENDER_CACHE_PATH", os.path.join(os.path.dirname(__file__), "render_cache.db")
+)
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", "512"))
+_RENDER_CACHE = RenderCache(RENDER_CACHE_PATH, max_entries=RENDER_CACHE_SIZE)
+
+# Pandoc worker pool: PANDOC_WORKERS warm `pandoc server` processes run at most
+# that many conversions at once, with up to PANDOC_QUEUE_SIZE waiting; a job
+# running past PANDOC_TIMEOUT seconds is abandoned and its server restarted
+PANDOC_WORKERS = int(os.environ.get("PANDOC_WORKERS", "2"))
+PANDOC_QUEUE_SIZE = int(os.environ.get("PANDOC_QUEUE_SIZE", "32"))
+PANDOC_TIMEOUT = float(os.environ.get("PANDOC_TIMEOUT", "10"))
+_PANDOC_POOL: PandocPool | None = None
+_PANDOC_POOL_LOCK = threading.Lock()
+
+# Commands whose output depends on the rest of the document: definitions
+# carry over into later snippets, footnotes are collected at the end, and
+# labels and section ids are numbered across the document. render_many()
+# converts snippets using them on their own.
+_CONTEXT_COMMANDS = re.compile(
+    r"\\(?:(?:re)?newcommand|providecommand|newenvironment|renewenvironment|DeclareMathOperator"
+    r"|def|gdef|edef|xdef|let|footnote|footnotetext|label|ref|eqref"
+    r"|part|chapter|(?:sub)*section|(?:sub)?paragraph)(?![A-Za-z])"
+)
+
+def get_latex_macros() -> str:
+    """Load LaTeX macro definitions from static/macros.tex, cached in memory."""
+    global _LATEX_MACROS_CACHE
+    if _LATEX_MACROS_CACHE is not None:
+        return _LATEX_MACROS_CACHE
+
+    try:
+        with open(MACROS_PATH, "r", encoding="utf-8") as f:
+            _LATEX_MACROS_CACHE = f.read()
+    except OSError:
+        # If the file is missing, just use an empty string so things still render.
+        _LATEX_MACROS_CACHE = ""
+    return _LATEX_MACROS_CACHE
+
+
+def get_pandoc_version() -> str:
+    """Return the installed Pandoc version string, cached in memory.
+
+    Part of the render cache key, so upgrading Pandoc re-renders everything.
+    """
+    global _PANDOC_VERSION_CACHE
+    if _PANDOC_VERSION_CACHE is not None:
+        return _PANDOC_VERSION_CACHE
+
+    version = ""
+    try:
+        if pypandoc is not None:
+            version = str(pypandoc.get_pandoc_version())
+    except Exception:
+        pass
+    if not version:
+        try:
+            proc = subprocess.run(
+                [_pandoc_binary(), "--version"], text=True, capture_output=True, check=True
+            )
+            version = proc.stdout.splitlines()[0] if proc.stdout else ""
+        except Exception:
+            pass
+    _PANDOC_VERSION_CACHE = version
+    return _PANDOC_VERSION_CACHE
+
+
+def rewrite_image_paths(html: str) -> str:
+    """Rewrite image src attributes from Pandoc output to point to Flask static files.
+
+    Assumes you've put PNGs in static/figures with the same base names as the
+    LaTeX figures.
+    """
+    if not html:
+        return html
+
+    def repl(match):
+        prefix, src, quote = match.group(1), match.group(2), match.group(3)
+        src_norm = src.lstrip("./")  # remove leading ./ but KEEP no leading /
+
+        # Case 1: src="figures/chain15.pdf" or "figures/chain15.jpg" or "figures/chain15.png"
+        if src_norm.startswith("figures/"):
+            rel = src_norm[len("figures/"):]  # "chain15.pdf"
+            base, ext = os.path.splitext(rel)
+            # Always point to PNG under /static/figures/
+            return f'{prefix}/static/figures/{base}.png{quote}'
+
+        # Case 2: src="static/figures/chain15.png" (missing leading slash)
+        if src_norm.startswith("static/figures/"):
+            return f'{prefix}/static/{src_norm[len("static/") :]}{quote}'
+
+        # Otherwise, leave it alone
+        return f"{prefix}{src}{quote}"
+
+    pattern = re.compile(r'(<img\b[^>]*\bsrc=["\'])([^"\']+)(["\'])', flags=re.IGNORECASE)
+    return pattern.sub(repl, html)
+
+
+def clean_latex_text(text: str) -> str:
+    """Return a copy of LaTeX text with leading TeX comment markers removed per-line.
+
+    This keeps the original DB content intact but ensures the HTML view shows the
+    commented-out lines (our importer may have prefixed lines with '%').
+    """
+    if text is None:
+        return text
+    
+    # Remove full-line comments
+    cleaned = re.sub(r'(?m)^[ \t]*%.*(?:\n|$)', '', text)
+
+    # Replace \textnormal{...} with \mathrm{...} so Pandoc's math parser understands it
+    cleaned = re.sub(r'\\textnormal\{([^}]*)\}', r'\\mathrm{\1}', cleaned)
+
+    # Remove leading \noin or \noindent at the very start (plus any following whitespace)
+    cleaned = re.sub(r'^\s*\\noin\b\s*', '', cleaned)
+    cleaned = re.sub(r'^\s*\\noindent\b\s*', '', cleaned)
+
+    # Pandoc's LaTeX math parser does not support the low-level primitive
+    # \displaylimits (used to alter operator limit placement). Replace it
+    # with \limits (or remove) so Pandoc can parse limits like \lim_{n\to\infty}.
+    cleaned = re.sub(r'\\displaylimits', r'\\limits', cleaned)
+
+    # Rewrite \includegraphics paths from .pdf/.jpg/.jpeg to .png
+    cleaned = re.sub(
+        r'(\\includegraphics(?:\[[^\]]*\])?\{)figures/([^}]+?)(?:\.pdf|\.jpg|\.jpeg)(\})',
+        r'\1figures/\2.png\3',
+        cleaned,
+    )
+
+    return cleaned
+
+
+def _pandoc_binary() -> str:
+    """Locate the pandoc executable, preferring the one pypandoc knows about."""
+    try:
+        if pypandoc is not None:
+            return pypandoc.get_pandoc_path()
+    except Exception:
+        pass
+    return "pandoc"
+
+
+def _get_pandoc_pool() -> PandocPool:
+    """Return the process-wide Pandoc worker pool, creating it on first use."""
+    global _PANDOC_POOL
+    with _PANDOC_POOL_LOCK:
+        if _PANDOC_POOL is None:
+            _PANDOC_POOL = PandocPool(
+                _pandoc_binary(),
+                {
+                    "from": "latex+latex_macros",  # understand \newcommand definitions
+                    "to": "html",
+                    "html-math-method": "mathml",  # emit MathML for equations
+                    "resource-path": ["static"],
+                },
+                workers=PANDOC_WORKERS,
+                queue_size=PANDOC_QUEUE_SIZE,
+                timeout=PANDOC_TIMEOUT,
+            )
+        return _PANDOC_POOL
+
+
+def run_pandoc(full_input: str, timeout: float | None = None) -> str | None:
+    """Convert a full LaTeX document to HTML, or return None if Pandoc fails.
+
+    Work is handed to the shared Pandoc pool, which bounds how many
+    conversions run at once and gives up on any that exceed PANDOC_TIMEOUT
+    (or `timeout`, if given).
+    """
+    return _get_pandoc_pool().convert(full_input, timeout=timeout)
+
+
+def source_hash(*parts: str | None) -> str:
+    """Hash the raw LaTeX fields of a problem together with the macros.
+
+    Stored next to the precompiled HTML in problems.db; when it no longer
+    matches the row's current text/answer, the stored HTML is stale.
+    Deliberately excludes the Pandoc version so the web server can check
+    freshness without Pandoc installed.
+    """
+    return render_key(get_latex_macros(), *(p or "" for p in parts))
+
+
+def render_latex(text: str) -> str | None:
+    """Render one LaTeX snippet to HTML, or return None if Pandoc failed.
+
+    Repeat conversions are served from the render cache, keyed by the
+    cleaned snippet, the macros and the Pandoc version.
+    """
+    cleaned = clean_latex_text(text)
+    macros = get_latex_macros()
+
+    key = render_key(cleaned, macros, get_pandoc_version())
+    cached = _RENDER_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    # Feed macros + body into Pandoc so it sees the \\newcommand definitions
+    full_input = (macros + "\n" + cleaned) if macros else cleaned
+
+    html = run_pandoc(full_input)
+    if html is None:
+        return None
+
+    # rewrite image paths so they point at Flask's /static/ location
+    html = rewrite_image_paths(html)
+    _RENDER_CACHE.put(key, html)
+    return html
+
+
+def render_many(snippets: list[str | None]) -> list[str | None]:
+    """Render many LaTeX snippets with as few Pandoc launches as possible.
+
+    Cache misses are joined into one document, separated by paragraphs
+    holding a unique marker, converted in a single Pandoc run and split back
+    apart on those markers. If the batch fails (or a snippet swallows a
+    marker, e.g. through an unbalanced brace) it is halved and retried, so
+    one bad snippet costs a few extra launches but never fails the others.
+    Snippets whose HTML would depend on their neighbours (definitions,
+    footnotes, labels, sections) are converted alone, so every result is
+    what render_latex() would produce and can share its cache.
+
+    Returns one entry per input: the HTML, or None for None inputs and
+    snippets Pandoc could not render on their own.
+    """
+    macros = get_latex_macros()
+    version = get_pandoc_version()
+
+    results: list[str | None] = [None] * len(snippets)
+    pending = []  # (index, cleaned, cache key)
+    for i, text in enumerate(snippets):
+        if text is None:
+            continue
+        cleaned = clean_latex_text(text)
+        key = render_key(cleaned, macros, version)
+        cached = _RENDER_CACHE.get(key)
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.append((i, cleaned, key))
+
+    alone = [p for p in pending if _CONTEXT_COMMANDS.search(p[1])]
+    batched = [p for p in pending if not _CONTEXT_COMMANDS.search(p[1])]
+    rendered = list(zip(batched, _render_batch([c for _, c, _ in batched], macros)))
+    rendered += [(p, _render_batch([p[1]], macros)[0]) for p in alone]
+    for (i, _, key), html in rendered:
+        if html is not None:
+            _RENDER_CACHE.put(key, html)
+        results[i] = html
+    return results
+
+
+def _render_batch(cleaned: list[str], macros: str) -> list[str | None]:
+    """Convert cleaned snippets in one Pandoc run, bisecting on failure."""
+    if not cleaned:
+        return []
+    if len(cleaned) == 1:
+        full_input = (macros + "\n" + cleaned[0]) if macros else cleaned[0]
+        html = run_pandoc(full_input)
+        return [rewrite_image_paths(html) if html is not None else None]
+
+    # Markers are plain alphanumerics so Pandoc passes them through as a
+    # paragraph of text: <p>RENDERSEP...N3</p>
+    marker = f"RENDERSEP{uuid.uuid4().hex}N"
+    body = "".join(f"\n\n{marker}{i}\n\n{text}" for i, text in enumerate(cleaned))
+    full_input = (macros + "\n" + body) if macros else body
+
+    html = run_pandoc(full_input, timeout=PANDOC_TIMEOUT * len(cleaned))
+    if html is not None:
+        parts = re.split(rf"<p>\s*{marker}(\d+)\s*</p>", html)
+        # parts = [preamble, "0", html0, "1", html1, ...]
+        indices = [int(n) for n in parts[1::2]]
+        if indices == list(range(len(cleaned))):
+            return [rewrite_image_paths(part.strip("\n")) for part in parts[2::2]]
+
+    mid = len(cleaned) // 2
+    return _render_batch(cleaned[:mid], macros) + _render_batch(cleaned[mid:], macros)
+
+
+def latex_to_html(text: str | None) -> str | None:
+    """Convert LaTeX snippet to HTML using pypandoc or pandoc binary.
+
+    - Prepends macros from static/macros.tex so commands like \\Pois are known.
+    - Enables the latex_macros extension in Pandoc.
+    - Uses MathML output so math renders without MathJax.
+
+    Returns None if input is None. On error, falls back to returning
+    the original text wrapped in <pre> to avoid losing content.
+    """
+    if text is None:
+        return None
+
+    html = render_latex(text)
+    if html is not None:
+        return html
+
+    # As a final fallback, return plain text inside <pre> (not cached, so a
+    # later request retries once Pandoc is available again)
+    print("exception in latex_to_html, falling back to <pre>")
+    cleaned = clean_latex_text(text)
+    safe_text = (
+        "<pre>"
+        + cleaned.replace("&", "&amp;")
+                 .replace("<", "&lt;")
+                 .replace(">", "&gt;")
+        + "</pre>"
+    )
+    return safe_text
@@ -0,0 +1,525 @@
+"""
+Versioned schema migrations for problems.db, attempts.db and users.db.
+
+Each database records the last migration applied in `PRAGMA user_version`.
+Steps are append-only: never edit a released step, add a new one with the
+next version number instead. Every step is idempotent, so the importer can
+re-run all of them (`force=True`) after it drops and recreates tables.
+
+Used by app.py at startup and by scripts/import_problems.py.
+"""
+
+import sqlite3
+
+
+def _table_exists(conn: sqlite3.Connection, name: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> set[str]:
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+# --- problems.db -------------------------------------------------------------
+
+def _problems_html_columns(conn):
+    """Precompiled HTML written by the importer (see latex.source_hash)."""
+    if not _table_exists(conn, "problems"):
+        return
+    existing = _columns(conn, "problems")
+    for col in ("html_text", "html_answer", "html_hash"):
+        if col not in existing:
+            conn.execute(f"ALTER TABLE problems ADD COLUMN {col} TEXT")
+
+
+def _problems_bank_meta(conn):
+    """Key/value table holding the bank version stamped by the importer."""
+    conn.execute("CREATE TABLE IF NOT EXISTS bank_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+
+def _problems_attempt_indexes(conn):
+    """Covering indexes for /progress and the solved-problems lookup."""
+    if not _table_exists(conn, "problem_attempts"):
+        return
+    # wrong problems (correct = 0) and solved set (correct = 1) per user
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_attempts_user_correct "
+        "ON problem_attempts (user_id, correct, problem_id, attempted_at)"
+    )
+    # per-topic stats per user
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_attempts_user_topic "
+        "ON problem_attempts (user_id, topic_id, correct)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_attempts_problem ON problem_attempts (problem_id)"
+    )
+
+
+def _problems_any_topic(conn):
+    """The catch-all "Any" topic, so logging an attempt never has to create it."""
+    if not _table_exists(conn, "topics"):
+        return
+    conn.execute("INSERT OR IGNORE INTO topics (name) VALUES ('Any')")
+
+
+PROBLEMS_MIGRATIONS = [
+    (1, _problems_html_columns),
+    (2, _problems_bank_meta),
+    (3, _problems_attempt_indexes),
+    (4, _problems_any_topic),
+]
+
+
+# --- attempts.db -------------------------------------------------------------
+
+def _attempts_table(conn):
+    """problem_attempts, moved out of problems.db so the bank is read-only.
+
+    Problem and topic ids refer to problems.db; there are no foreign keys
+    across files, so the app and the importer keep them consistent.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS problem_attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            problem_id INTEGER NOT NULL,
+            topic_id INTEGER NOT NULL,
+            correct INTEGER NOT NULL,
+            attempted_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+ATTEMPTS_MIGRATIONS = [
+    (1, _attempts_table),
+    # the same indexes the table had in problems.db
+    (2, _problems_attempt_indexes),
+]
+
+
+def move_attempts(problems_path: str, attempts_path: str) -> int:
+    """Move problem_attempts rows left in problems.db into attempts.db.
+
+    Rows keep their ids, so a move interrupted between the two files'
+    commits is simply redone. The emptied table is dropped from problems.db.
+    Tables in an older layout are left for the importer's rebuild, which
+    remaps them.
+    Returns the number of rows moved.
+    """
+    conn = sqlite3.connect(attempts_path, isolation_level=None)
+    try:
+        conn.execute("ATTACH DATABASE ? AS bank", (problems_path,))
+        columns = {r[1] for r in conn.execute("PRAGMA bank.table_info(problem_attempts)")}
+        if not {"id", "user_id", "problem_id", "topic_id", "correct", "attempted_at"} <= columns:
+            # no table, or an older layout: the importer migrates those
+            return 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            moved = conn.execute(
+                "INSERT OR IGNORE INTO main.problem_attempts "
+                "(id, user_id, problem_id, topic_id, correct, attempted_at) "
+                "SELECT id, user_id, problem_id, topic_id, correct, attempted_at "
+                "FROM bank.problem_attempts"
+            ).rowcount
+            conn.execute("DROP TABLE bank.problem_attempts")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return moved
+    finally:
+        conn.close()
+
+
+# --- users.db ----------------------------------------------------------------
+
+def _users_game_indexes(conn):
+    """Indexes for the Monty Hall stats and the Blotchville leaderboard."""
+    if _table_exists(conn, "monty_stats"):
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_monty_stats_user "
+            "ON monty_stats (user_id, switched, won)"
+        )
+    if _table_exists(conn, "leaderboard"):
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_leaderboard_score ON leaderboard (score DESC)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_leaderboard_user ON leaderboard (user_id, score)"
+        )
+
+
+def rebuild_monty_totals(conn):
+    """Recompute every user's Monty Hall counters from the raw monty_stats rows.
+
+    Used by the migration that introduces the counters and by
+    scripts/backfill_monty_totals.py to repair them.
+    """
+    conn.execute("DELETE FROM monty_totals")
+    conn.execute(
+        """
+        INSERT INTO monty_totals (user_id, switch_attempts, switch_wins, stay_attempts, stay_wins)
+        SELECT
+            user_id,
+            SUM(switched = 1),
+            SUM(switched = 1 AND won = 1),
+            SUM(switched = 0),
+            SUM(switched = 0 AND won = 1)
+        FROM monty_stats
+        GROUP BY user_id
+        """
+    )
+
+
+def _users_monty_totals(conn):
+    """Per-user Monty Hall counters, kept in step with monty_stats by triggers.
+
+    The triggers run inside the statement that changes monty_stats, so the
+    counters are always updated in the same transaction as the raw row.
+    """
+    if not _table_exists(conn, "monty_stats"):
+        return
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS monty_totals (
+            user_id INTEGER PRIMARY KEY,
+            switch_attempts INTEGER NOT NULL DEFAULT 0,
+            switch_wins INTEGER NOT NULL DEFAULT 0,
+            stay_attempts INTEGER NOT NULL DEFAULT 0,
+            stay_wins INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS monty_stats_count_insert AFTER INSERT ON monty_stats
+        BEGIN
+            INSERT INTO monty_totals (user_id, switch_attempts, switch_wins, stay_attempts, stay_wins)
+            VALUES (
+                NEW.user_id,
+                NEW.switched = 1,
+                NEW.switched = 1 AND NEW.won = 1,
+                NEW.switched = 0,
+                NEW.switched = 0 AND NEW.won = 1
+            )
+            ON CONFLICT(user_id) DO UPDATE SET
+                switch_attempts = switch_attempts + excluded.switch_attempts,
+                switch_wins = switch_wins + excluded.switch_wins,
+                stay_attempts = stay_attempts + excluded.stay_attempts,
+                stay_wins = stay_wins + excluded.stay_wins;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS monty_stats_count_delete AFTER DELETE ON monty_stats
+        BEGIN
+            UPDATE monty_totals SET
+                switch_attempts = switch_attempts - (OLD.switched = 1),
+                switch_wins = switch_wins - (OLD.switched = 1 AND OLD.won = 1),
+                stay_attempts = stay_attempts - (OLD.switched = 0),
+                stay_wins = stay_wins - (OLD.switched = 0 AND OLD.won = 1)
+            WHERE user_id = OLD.user_id;
+        END
+        """
+    )
+    rebuild_monty_totals(conn)
+
+
+# Number of games kept in the materialized Blotchville top list
+LEADERBOARD_TOP_K = 5
+
+
+def rebuild_leaderboard_views(conn):
+    """Recompute the top-K games and every user's best score from leaderboard."""
+    conn.execute("DELETE FROM leaderboard_top")
+    conn.execute(
+        f"""
+        INSERT INTO leaderboard_top (id, user_id, score, timestamp)
+        SELECT id, user_id, score, timestamp FROM leaderboard
+        ORDER BY score DESC, id
+        LIMIT {LEADERBOARD_TOP_K}
+        """
+    )
+    conn.execute("DELETE FROM leaderboard_best")
+    # bare columns with MAX() come from the row holding the max score
+    conn.execute(
+        """
+        INSERT INTO leaderboard_best (user_id, score, timestamp)
+        SELECT user_id, MAX(score), timestamp FROM leaderboard GROUP BY user_id
+        """
+    )
+
+
+def _users_leaderboard_views(conn):
+    """Materialized Blotchville leaderboards, maintained by triggers.
+
+    - leaderboard_top holds the best LEADERBOARD_TOP_K games overall, so the
+      game page reads a handful of rows instead of sorting every game.
+    - leaderboard_best holds each user's best score, for per-user rankings.
+    """
+    if not _table_exists(conn, "leaderboard"):
+        return
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_top (
+            id INTEGER PRIMARY KEY,  -- leaderboard.id
+            user_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            timestamp DATETIME
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_best (
+            user_id INTEGER PRIMARY KEY,
+            score INTEGER NOT NULL,
+            timestamp DATETIME,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_best_score ON leaderboard_best (score DESC)"
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS leaderboard_top_insert AFTER INSERT ON leaderboard
+        WHEN (SELECT COUNT(*) FROM leaderboard_top) < {LEADERBOARD_TOP_K}
+          OR NEW.score > (SELECT MIN(score) FROM leaderboard_top)
+        BEGIN
+            INSERT INTO leaderboard_top (id, user_id, score, timestamp)
+            VALUES (NEW.id, NEW.user_id, NEW.score, NEW.timestamp);
+            DELETE FROM leaderboard_top WHERE id NOT IN (
+                SELECT id FROM leaderboard_top ORDER BY score DESC, id LIMIT {LEADERBOARD_TOP_K}
+            );
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS leaderboard_best_insert AFTER INSERT ON leaderboard
+        BEGIN
+            INSERT INTO leaderboard_best (user_id, score, timestamp)
+            VALUES (NEW.user_id, NEW.score, NEW.timestamp)
+            ON CONFLICT(user_id) DO UPDATE SET
+                score = excluded.score,
+                timestamp = excluded.timestamp
+            WHERE excluded.score > leaderboard_best.score;
+        END
+        """
+    )
+    # Deleting games is rare (manual cleanup), so just recompute from the index
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS leaderboard_views_delete AFTER DELETE ON leaderboard
+        BEGIN
+            DELETE FROM leaderboard_top;
+            INSERT INTO leaderboard_top (id, user_id, score, timestamp)
+            SELECT id, user_id, score, timestamp FROM leaderboard
+            ORDER BY score DESC, id LIMIT {LEADERBOARD_TOP_K};
+            DELETE FROM leaderboard_best WHERE user_id = OLD.user_id;
+            INSERT INTO leaderboard_best (user_id, score, timestamp)
+            SELECT user_id, MAX(score), timestamp FROM leaderboard
+            WHERE user_id = OLD.user_id GROUP BY user_id;
+        END
+        """
+    )
+    rebuild_leaderboard_views(conn)
+
+
+def rebuild_cafe_tallies(conn):
+    """Recompute the per-cafe vote counts from cafe_votes."""
+    conn.execute("DELETE FROM cafe_tallies")
+    conn.execute(
+        """
+        INSERT INTO cafe_tallies (category, cafe, votes)
+        SELECT category, cafe, COUNT(*) FROM cafe_votes GROUP BY category, cafe
+        """
+    )
+
+
+def _users_cafe_tallies(conn):
+    """Per-(category, cafe) vote counts, kept in step with cafe_votes by triggers.
+
+    The poll writes with INSERT OR REPLACE, and REPLACE does not fire delete
+    triggers, so the vote being replaced is taken off its cafe in a BEFORE
+    INSERT trigger and the new vote is added after the insert.
+    """
+    if not _table_exists(conn, "cafe_votes"):
+        return
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cafe_tallies (
+            category TEXT NOT NULL,
+            cafe TEXT NOT NULL,
+            votes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (category, cafe)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS cafe_votes_replace BEFORE INSERT ON cafe_votes
+        BEGIN
+            UPDATE cafe_tallies SET votes = votes - 1
+            WHERE (category, cafe) IN (
+                SELECT category, cafe FROM cafe_votes
+                WHERE user_id = NEW.user_id AND category = NEW.category
+            );
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS cafe_votes_count_insert AFTER INSERT ON cafe_votes
+        BEGIN
+            INSERT INTO cafe_tallies (category, cafe, votes) VALUES (NEW.category, NEW.cafe, 1)
+            ON CONFLICT(category, cafe) DO UPDATE SET votes = votes + 1;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS cafe_votes_count_update AFTER UPDATE OF category, cafe ON cafe_votes
+        BEGIN
+            UPDATE cafe_tallies SET votes = votes - 1
+            WHERE category = OLD.category AND cafe = OLD.cafe;
+            INSERT INTO cafe_tallies (category, cafe, votes) VALUES (NEW.category, NEW.cafe, 1)
+            ON CONFLICT(category, cafe) DO UPDATE SET votes = votes + 1;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS cafe_votes_count_delete AFTER DELETE ON cafe_votes
+        BEGIN
+            UPDATE cafe_tallies SET votes = votes - 1
+            WHERE category = OLD.category AND cafe = OLD.cafe;
+        END
+        """
+    )
+    rebuild_cafe_tallies(conn)
+
+
+def _users_monty_totals_update(conn):
+    """Keep monty_totals right when a monty_stats row is edited.
+
+    The counters only followed inserts and deletes, so correcting a game in
+    place left them stale. Like cafe_votes, an UPDATE now takes the old row
+    off and adds the new one; the counters are rebuilt once to repair any
+    drift.
+    """
+    if _table_exists(conn, "monty_stats"):
+        conn.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS monty_stats_count_update
+            AFTER UPDATE OF user_id, switched, won ON monty_stats
+            BEGIN
+                UPDATE monty_totals SET
+                    switch_attempts = switch_attempts - (OLD.switched = 1),
+                    switch_wins = switch_wins - (OLD.switched = 1 AND OLD.won = 1),
+                    stay_attempts = stay_attempts - (OLD.switched = 0),
+                    stay_wins = stay_wins - (OLD.switched = 0 AND OLD.won = 1)
+                WHERE user_id = OLD.user_id;
+                INSERT INTO monty_totals (user_id, switch_attempts, switch_wins, stay_attempts, stay_wins)
+                VALUES (
+                    NEW.user_id,
+                    NEW.switched = 1,
+                    NEW.switched = 1 AND NEW.won = 1,
+                    NEW.switched = 0,
+                    NEW.switched = 0 AND NEW.won = 1
+                )
+                ON CONFLICT(user_id) DO UPDATE SET
+                    switch_attempts = switch_attempts + excluded.switch_attempts,
+                    switch_wins = switch_wins + excluded.switch_wins,
+                    stay_attempts = stay_attempts + excluded.stay_attempts,
+                    stay_wins = stay_wins + excluded.stay_wins;
+            END
+            """
+        )
+        rebuild_monty_totals(conn)
+
+
+def _users_leaderboard_update(conn):
+    """Keep the leaderboard views right when a game's score or user is edited.
+
+    As for deletes, the top list and the best score of the old and new user
+    are recomputed from the index, so an admin correcting a bad score no
+    longer leaves it on the board. The views are rebuilt once to repair
+    any drift.
+    """
+    if _table_exists(conn, "leaderboard"):
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS leaderboard_views_update
+            AFTER UPDATE OF user_id, score, timestamp ON leaderboard
+            BEGIN
+                DELETE FROM leaderboard_top;
+                INSERT INTO leaderboard_top (id, user_id, score, timestamp)
+                SELECT id, user_id, score, timestamp FROM leaderboard
+                ORDER BY score DESC, id LIMIT {LEADERBOARD_TOP_K};
+                DELETE FROM leaderboard_best WHERE user_id IN (OLD.user_id, NEW.user_id);
+                INSERT INTO leaderboard_best (user_id, score, timestamp)
+                SELECT user_id, MAX(score), timestamp FROM leaderboard
+                WHERE user_id IN (OLD.user_id, NEW.user_id) GROUP BY user_id;
+            END
+            """
+        )
+        rebuild_leaderboard_views(conn)
+
+
+USERS_MIGRATIONS = [
+    (1, _users_game_indexes),
+    (2, _users_monty_totals),
+    (3, _users_leaderboard_views),
+    (4, _users_cafe_tallies),
+    (5, _users_monty_totals_update),
+    (6, _users_leaderboard_update),
+]
+
+
+# --- runner ------------------------------------------------------------------
+
+def migrate(conn: sqlite3.Connection, steps, force: bool = False) -> int:
+    """Apply pending `steps` on `conn` and bump its user_version.
+
+    Runs on the caller's connection without committing, so it can share a
+    transaction with other work (the importer's rebuild). With `force`,
+    every step runs again regardless of the recorded version.
+    Returns the number of steps applied.
+    """
+    current = 0 if force else conn.execute("PRAGMA user_version").fetchone()[0]
+    applied = 0
+    for version, step in steps:
+        if version <= current:
+            continue
+        step(conn)
+        # PRAGMA arguments can't be bound parameters; version is an int we own
+        conn.execute(f"PRAGMA user_version = {int(version)}")
+        applied += 1
+    return applied
+
+
+def migrate_file(path: str, steps) -> int:
+    """Open the database at `path`, apply pending `steps` in one transaction."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            applied = migrate(conn, steps)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return applied
+    finally:
+        conn.close()
@@ -0,0 +1,234 @@
+"""
+Bounded pool of warm Pandoc workers.
+
+A fixed number of long-lived worker threads pull conversion jobs off a
+bounded queue. Each worker owns one `pandoc server` process (Pandoc 3.0+)
+on a local port and posts its jobs to it, so a conversion costs an HTTP
+round trip rather than a process launch. This caps how many conversions a
+burst of requests can run at once and gives every job a hard timeout.
+
+A server is checked with a `/version` request when it starts, and is
+restarted when it has exited, dropped a connection or run past a job's
+timeout (it is killed then, taking the runaway conversion with it). When
+the Pandoc binary has no `server` command, workers fall back to starting
+one `pandoc` process per job. A job that fails for any reason fails alone:
+its caller gets None and the worker moves on to the next job.
+"""
+
+import atexit
+import http.client
+import json
+import logging
+import queue
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Pandoc's own limit per request; the pool enforces the real per-job timeout
+_SERVER_TIMEOUT = 3600
+# How long a new server gets to answer its first /version check
+_STARTUP_TIMEOUT = 10.0
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class _Server:
+    """One `pandoc server` process, used by a single worker thread."""
+
+    def __init__(self, pandoc: str):
+        self.pandoc = pandoc
+        self.proc: subprocess.Popen | None = None
+        self.url: str | None = None
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self) -> bool:
+        """Start the server and wait until it answers; False if it never does."""
+        self.stop()
+        port = _free_port()
+        try:
+            proc = subprocess.Popen(
+                [self.pandoc, "server", f"--port={port}", f"--timeout={_SERVER_TIMEOUT}"],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError:
+            return False
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + _STARTUP_TIMEOUT
+        while time.monotonic() < deadline and proc.poll() is None:
+            try:
+                with urllib.request.urlopen(url + "/version", timeout=1) as response:
+                    response.read()
+            except OSError:
+                time.sleep(0.05)
+                continue
+            self.proc, self.url = proc, url
+            return True
+        proc.kill()
+        proc.wait()
+        return False
+
+    def stop(self) -> None:
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = self.url = None
+
+    def convert(self, options: dict, full_input: str, timeout: float) -> str | None:
+        """Post one conversion.
+
+        Raises OSError or HTTPException (timeouts included) when the server
+        itself is suspect; returns None when Pandoc just rejected the input.
+        """
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({**options, "text": full_input}).encode(),
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError:
+            return None  # Pandoc rejected this input; the server itself is fine
+        if not isinstance(result, dict) or "output" not in result or result.get("base64"):
+            return None
+        return result["output"]
+
+
+class PandocPool:
+    """Run Pandoc conversions on `workers` warm servers fed by a bounded queue.
+
+    `options` are Pandoc server options ("from", "to", "html-math-method",
+    "resource-path"); the per-process fallback passes the same ones as
+    command-line flags.
+    """
+
+    def __init__(self, pandoc: str, options: dict, workers: int = 2, queue_size: int = 32, timeout: float = 10.0):
+        self.pandoc = pandoc
+        self.options = options
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self._jobs: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._threads: list[threading.Thread] = []
+        self._servers: list[_Server] = []
+        self._lock = threading.Lock()
+        # None until the first server start tells us whether `pandoc server` works
+        self._server_mode: bool | None = None
+        atexit.register(self.close)
+
+    def convert(self, full_input: str, timeout: float | None = None) -> str | None:
+        """Convert `full_input` and wait for the HTML.
+
+        `timeout` overrides the pool's per-job timeout (e.g. for large batch
+        documents). Returns None if the queue stays full for longer than the
+        pool timeout, if Pandoc fails, or if it runs past the timeout.
+        """
+        self._ensure_workers()
+
+        future: Future = Future()
+        try:
+            self._jobs.put((full_input, timeout or self.timeout, future), timeout=self.timeout)
+        except queue.Full:
+            logger.warning("pandoc pool: queue full, giving up on conversion")
+            return None
+        return future.result()
+
+    def close(self) -> None:
+        """Stop the Pandoc servers (workers start new ones if used again)."""
+        with self._lock:
+            servers = list(self._servers)
+        for server in servers:
+            server.stop()
+
+    def _ensure_workers(self) -> None:
+        """Start the workers on first use and restart any that have died."""
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._work, name="pandoc-worker", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _work(self) -> None:
+        server = _Server(self.pandoc)
+        with self._lock:
+            self._servers.append(server)
+        while True:
+            full_input, timeout, future = self._jobs.get()
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(self._convert(server, full_input, timeout))
+            except BaseException:
+                # fail this job only; the worker stays up for the next one
+                logger.exception("pandoc pool: conversion failed")
+                if not future.done():
+                    future.set_result(None)
+            finally:
+                self._jobs.task_done()
+
+    def _convert(self, server: _Server, full_input: str, timeout: float) -> str | None:
+        if self._server_mode is not False and not server.alive():
+            started = server.start()
+            if self._server_mode is None:
+                self._server_mode = started
+                if not started:
+                    logger.warning("pandoc pool: `pandoc server` is unavailable (it needs Pandoc 3.0);"
+                                   " starting a process per conversion")
+            elif not started:
+                logger.warning("pandoc pool: could not restart pandoc server")
+        if not server.alive():
+            return self._run(full_input, timeout)
+
+        try:
+            return server.convert(self.options, full_input, timeout)
+        except (OSError, http.client.HTTPException) as e:
+            # timed out, or the server died mid-job: kill it, the next job starts a fresh one
+            logger.warning("pandoc pool: pandoc server failed (%s); restarting it", e)
+            server.stop()
+            return None
+
+    def _command(self) -> list[str]:
+        args = [self.pandoc, "--from", self.options["from"], "--to", self.options["to"]]
+        if "html-math-method" in self.options:
+            args.append("--" + self.options["html-math-method"])
+        if "resource-path" in self.options:
+            args.append("--resource-path=" + ":".join(self.options["resource-path"]))
+        return args
+
+    def _run(self, full_input: str, timeout: float) -> str | None:
+        """Convert with a one-off Pandoc process."""
+        try:
+            proc = subprocess.Popen(
+                self._command(),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+        except OSError:
+            return None
+
+        try:
+            out, err = proc.communicate(full_input, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            logger.warning("pandoc pool: conversion timed out after %ss", timeout)
+            return None
+
+        if proc.returncode != 0:
+            return None
+        return out
@@ -0,0 +1,104 @@
+"""
+Two-tier cache for rendered LaTeX HTML.
+
+Entries are content-addressed: the key is a hash of everything that affects
+Pandoc's output (the cleaned snippet, static/macros.tex and the Pandoc
+version), so a stale entry can never be served and nothing ever needs to be
+invalidated by hand.
+
+- Tier 1 is an in-process LRU bounded by `max_entries`.
+- Tier 2 is a small SQLite file that survives restarts and is shared by all
+  workers on the same host.
+"""
+
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def render_key(*parts: str) -> str:
+    """Return a stable hex digest for the given input parts."""
+    h = hashlib.sha256()
+    for part in parts:
+        data = (part or "").encode("utf-8")
+        # length-prefix each part so ("ab", "c") and ("a", "bc") differ
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class RenderCache:
+    """LRU memory cache in front of a persistent SQLite key/value table."""
+
+    def __init__(self, path: str | None, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._memory: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if path:
+            try:
+                self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS rendered_html ("
+                    " key TEXT PRIMARY KEY,"
+                    " html TEXT NOT NULL,"
+                    " created_at TEXT DEFAULT CURRENT_TIMESTAMP)"
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                # The disk tier is an optimisation only; keep serving from memory.
+                print(f"render cache disabled on disk: {e}")
+                self._conn = None
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            html = self._memory.get(key)
+            if html is not None:
+                self._memory.move_to_end(key)
+                return html
+
+            if self._conn is None:
+                return None
+            try:
+                row = self._conn.execute(
+                    "SELECT html FROM rendered_html WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error:
+                return None
+            if row is None:
+                return None
+
+            # promote to the memory tier
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, key: str, html: str) -> None:
+        with self._lock:
+            self._remember(key, html)
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rendered_html (key, html) VALUES (?, ?)",
+                    (key, html),
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"render cache write failed: {e}")
+
+    def clear(self) -> None:
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM rendered_html")
+                self._conn.commit()
+
+    def _remember(self, key: str, html: str) -> None:
+        self._memory[key] = html
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,40 @@
+"""
+Rebuild the per-user Monty Hall counters (`monty_totals`) in `users.db`
+from the full `monty_stats` history.
+
+The counters are normally kept up to date by triggers and are filled in
+once by the migration that creates them. Run this only if they ever drift,
+for example after editing `monty_stats` by hand with triggers disabled.
+"""
+
+import os
+import sqlite3
+import sys
+
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DB_PATH = os.path.join(BASE, 'users.db')
+
+sys.path.insert(0, BASE)
+import migrations  # noqa: E402
+
+if not os.path.exists(DB_PATH):
+    print(f"Database not found at {DB_PATH}")
+    sys.exit(1)
+
+conn = sqlite3.connect(DB_PATH, isolation_level=None)
+try:
+    conn.execute('BEGIN IMMEDIATE')
+    # make sure the counters table and triggers exist before rebuilding
+    migrations.migrate(conn, migrations.USERS_MIGRATIONS)
+    migrations.rebuild_monty_totals(conn)
+    conn.execute('COMMIT')
+    users, rounds = conn.execute(
+        'SELECT COUNT(*), COALESCE(SUM(switch_attempts + stay_attempts), 0) FROM monty_totals'
+    ).fetchone()
+    print(f'Rebuilt Monty Hall counters for {users} users ({rounds} rounds).')
+except Exception:
+    if conn.in_transaction:
+        conn.execute('ROLLBACK')
+    raise
+finally:
+    conn.close()
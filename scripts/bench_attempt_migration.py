@@ -0,0 +1,175 @@
+"""
+Benchmark the problem_attempts migration in import_problems.py.
+
+Builds a synthetic bank (--problems problems over a few topics) and a
+synthetic attempt history (--attempts rows, a small share pointing at
+problems that no longer exist) in a temporary old-style bank that still
+keeps its attempts in problems.db, then runs the same steps as
+`import_problems.py --attempts=migrate`: snapshot, build the new bank,
+migrate the attempts into a separate attempts.db. Rendering is skipped, so
+Pandoc is not needed.
+
+The old migration ran a few queries per attempt. A copy of it is timed on
+the first --legacy attempts (0 to skip) and its output is checked against
+the new migration's output for the same attempts.
+
+Usage: python3 scripts/bench_attempt_migration.py [--attempts N] [--problems N] [--legacy N]
+"""
+
+import argparse
+import csv
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import import_problems  # noqa: E402
+import migrations  # noqa: E402  (importable once import_problems has set up the path)
+
+TOPICS = ('Probability', 'Counting', 'Conditioning', 'Expectation', 'Markov chains')
+
+
+def write_csv(path, n_problems, rng):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('Year', 'Problem', 'Text') + TOPICS)
+        for i in range(n_problems):
+            # numbers are unique across years, so the old (problem-only) match agrees
+            year, number = 2010 + i // 20, i + 1
+            flags = ['1' if rng.random() < 0.3 else '0' for _ in TOPICS]
+            writer.writerow((year, number, f'Problem {number} of {year}: find $P(A_{{{i}}})$.', *flags))
+
+
+def seed_history(cur, csv_path, n_attempts, rng):
+    """Load the bank and `n_attempts` random attempts into an empty database."""
+    import_problems.rebuild_schema(cur)
+    import_problems.import_problems(cur, csv_path, import_problems.DEFAULT_BATCH_SIZE)
+    # the old layout, with the topic in a text column
+    cur.execute('CREATE TABLE problem_attempts (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, '
+                'problem_id INTEGER, topic TEXT, correct INTEGER, attempted_at TEXT)')
+    max_pid = cur.execute('SELECT MAX(id) FROM problems').fetchone()[0]
+    max_tid = cur.execute('SELECT MAX(id) FROM topics').fetchone()[0]
+
+    def attempts():
+        for _ in range(n_attempts):
+            # ~2% of attempts point at problems that are gone
+            pid = rng.randint(1, max_pid) if rng.random() < 0.98 else max_pid + rng.randint(1, 100)
+            yield (rng.randint(1, 5000), pid, str(rng.randint(1, max_tid)), rng.random() < 0.6,
+                   f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00')
+
+    for batch in import_problems.batched(attempts(), 10_000):
+        cur.executemany('INSERT INTO problem_attempts (user_id, problem_id, topic, correct, attempted_at) '
+                        'VALUES (?,?,?,?,?)', batch)
+
+
+def legacy_migrate(cur, orig_problems, orig_attempts):
+    """The old per-attempt migration loop, condensed."""
+    rows = []
+    for aid, user_id, old_problem_id, old_topic_text, correct, attempted_at in orig_attempts:
+        problem_text = orig_problems.get(old_problem_id, {}).get('problem')
+        if not problem_text:
+            continue
+        r = cur.execute('SELECT id FROM problems WHERE problem = ? LIMIT 1', (problem_text,)).fetchone()
+        if not r:
+            continue
+        new_pid = r[0]
+        trow = cur.execute('SELECT topic_id FROM problem_topics WHERE problem_id = ? LIMIT 1', (new_pid,)).fetchone()
+        topic_id = trow[0] if trow else None
+        if topic_id is None and old_topic_text:
+            try:
+                maybe_id = int(old_topic_text)
+                if cur.execute('SELECT id FROM topics WHERE id = ? LIMIT 1', (maybe_id,)).fetchone():
+                    topic_id = maybe_id
+            except Exception:
+                r = cur.execute('SELECT id FROM topics WHERE name = ? LIMIT 1', (old_topic_text,)).fetchone()
+                if r:
+                    topic_id = r[0]
+        if topic_id is None:
+            cur.execute('INSERT OR IGNORE INTO topics (name) VALUES (?)', ('Any',))
+            topic_id = cur.execute('SELECT id FROM topics WHERE name = ? LIMIT 1', ('Any',)).fetchone()[0]
+        rows.append((user_id, new_pid, topic_id, correct, attempted_at))
+    return rows
+
+
+def migrated_rows(cur):
+    return cur.execute('SELECT user_id, problem_id, topic_id, correct, attempted_at '
+                       'FROM problem_attempts ORDER BY id').fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--attempts', type=int, default=1_000_000)
+    parser.add_argument('--problems', type=int, default=2000)
+    parser.add_argument('--legacy', type=int, default=20_000,
+                        help='attempts to run through the old loop for comparison (default: %(default)s)')
+    args = parser.parse_args()
+
+    rng = random.Random(110)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(tmpdir, 'problems.csv')
+        old_path = os.path.join(tmpdir, 'problems.db')
+        new_path = os.path.join(tmpdir, 'problems-new.db')
+        attempts_path = os.path.join(tmpdir, 'attempts.db')
+        write_csv(csv_path, args.problems, rng)
+
+        conn = sqlite3.connect(old_path, isolation_level=None)
+        cur = conn.cursor()
+        for pragma in import_problems.BULK_PRAGMAS:
+            cur.execute(pragma)
+        cur.execute('BEGIN')
+        seed_history(cur, csv_path, args.attempts, rng)
+        cur.execute('COMMIT')
+        print(f'\nSeeded {args.problems:,} problems and {args.attempts:,} attempts.\n')
+
+        start = time.perf_counter()
+        orig_problems, orig_topics, orig_attempts = import_problems.snapshot_existing(cur)
+        print(f'Snapshot: {time.perf_counter() - start:.2f}s')
+        conn.close()
+
+        conn = sqlite3.connect(new_path, isolation_level=None)
+        cur = conn.cursor()
+        for pragma in import_problems.BULK_PRAGMAS:
+            cur.execute(pragma)
+        cur.execute('BEGIN')
+        import_problems.rebuild_schema(cur)
+        import_problems.import_problems(cur, csv_path, import_problems.DEFAULT_BATCH_SIZE,
+                                        orig_problems, orig_topics)
+        import_problems.finish(cur)
+        cur.execute('COMMIT')
+        conn.close()
+        migrations.migrate_file(attempts_path, migrations.ATTEMPTS_MIGRATIONS)
+
+        sample = orig_attempts[:args.legacy]
+        if sample:
+            conn = sqlite3.connect(attempts_path, isolation_level=None)
+            cur = conn.cursor()
+            cur.execute('ATTACH DATABASE ? AS bank', (new_path,))
+            cur.execute('BEGIN')
+            start = time.perf_counter()
+            expected = legacy_migrate(cur, orig_problems, sample)
+            elapsed = time.perf_counter() - start
+            print(f'\nLegacy loop: {len(sample):,} attempts in {elapsed:.2f}s '
+                  f'({len(sample) / elapsed:,.0f} attempts/s, '
+                  f'~{elapsed / len(sample) * len(orig_attempts):,.0f}s projected for all)')
+            import_problems.migrate_attempts(cur, orig_problems, sample)
+            same = migrated_rows(cur) == expected
+            cur.execute('ROLLBACK')
+            conn.close()
+            print(f'Sample output matches legacy loop: {"yes" if same else "NO"}\n')
+
+        start = time.perf_counter()
+        options = argparse.Namespace(attempts_db=attempts_path, attempts='migrate',
+                                     batch_size=import_problems.DEFAULT_BATCH_SIZE)
+        import_problems.migrate_legacy_attempts(options, new_path, orig_problems, orig_attempts)
+        print(f'\nHash-join migration: {len(orig_attempts):,} attempts in {time.perf_counter() - start:.2f}s')
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Micro-benchmark of the database layer on the app's hottest lookups.
+
+Times the same primary-key queries through:
+- cs50's `SQL.execute` (the wrapper the app used before database.py),
+  if the cs50 package is installed
+- `Database.execute` (cs50-compatible, list of dicts)
+- `Database.query_one` (cached statement, sqlite3.Row)
+
+Runs against a migrated, temporary copy of `users.db`, so the real file
+is never switched to WAL mode or otherwise touched.
+
+Usage: python3 scripts/bench_db.py [iterations]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DB_PATH = os.path.join(BASE, 'users.db')
+
+sys.path.insert(0, BASE)
+import migrations  # noqa: E402
+from database import Database  # noqa: E402
+
+QUERIES = [
+    ('users.hash by id', 'SELECT hash FROM users WHERE id = ?'),
+    ('monty_totals by user', 'SELECT switch_attempts, switch_wins, stay_attempts, stay_wins '
+                             'FROM monty_totals WHERE user_id = ?'),
+]
+
+
+def bench(label, fn, args, iterations):
+    fn(*args)  # warm up: open the connection, prepare the statement
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f'  {label:<28} {elapsed / iterations * 1e6:8.1f} us/query')
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    if not os.path.exists(DB_PATH):
+        print(f"Database not found at {DB_PATH}")
+        sys.exit(1)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'users.db')
+        shutil.copy(DB_PATH, path)
+        # bring the copy up to the schema the app runs against
+        migrations.migrate_file(path, migrations.USERS_MIGRATIONS)
+
+        try:
+            from cs50 import SQL
+            cs50_db = SQL(f'sqlite:///{path}')
+        except ImportError:
+            cs50_db = None
+            print('cs50 not installed, skipping the cs50 SQL baseline')
+
+        db = Database(path)
+        row = db.query_one('SELECT id FROM users ORDER BY id LIMIT 1')
+        user_id = row['id'] if row else 1
+
+        print(f'{iterations} iterations per query')
+        for name, sql in QUERIES:
+            print(name)
+            if cs50_db is not None:
+                bench('cs50 SQL.execute', cs50_db.execute, (sql, user_id), iterations)
+            bench('Database.execute', db.execute, (sql, user_id), iterations)
+            bench('Database.query_one', db.query_one, (sql, user_id), iterations)
+        db.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark the session backends in sessions.py against each other.
+
+For each backend, a bare Flask app logs one client in and then times:
+- views: requests that only read session["user_id"], as most pages do
+- logins: session.clear() followed by a write, as /login does
+
+Everything runs in a temporary directory (session files, sessions.db and
+the generated secret key), so nothing in the repo is touched. The
+filesystem backend is skipped if Flask-Session is not installed.
+
+Usage: python3 scripts/bench_sessions.py [iterations]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+sys.path.insert(0, BASE)
+import sessions  # noqa: E402
+from flask import Flask, session  # noqa: E402
+
+
+def make_app(backend):
+    app = Flask(__name__)
+    sessions.init_app(app, backend)
+
+    @app.route('/login')
+    def login():
+        session.clear()
+        session['user_id'] = 1
+        return ''
+
+    @app.route('/view')
+    def view():
+        return str(session.get('user_id'))
+
+    return app
+
+
+def bench(label, client, url, iterations):
+    client.get(url)  # warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        client.get(url)
+    elapsed = time.perf_counter() - start
+    print(f'  {label:<8} {elapsed / iterations * 1e6:8.1f} us/request')
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    cwd = os.getcwd()
+    tmpdir = tempfile.mkdtemp()
+    os.chdir(tmpdir)
+    try:
+        print(f'{iterations} requests each')
+        for backend in sessions.BACKENDS:
+            try:
+                app = make_app(backend)
+            except ImportError:
+                print(f'{backend}: Flask-Session not installed, skipping')
+                continue
+            client = app.test_client()
+            client.get('/login')
+            print(backend)
+            bench('views', client, '/view', iterations)
+            bench('logins', client, '/login', iterations)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
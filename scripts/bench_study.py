@@ -0,0 +1,141 @@
+"""
+Benchmark concurrent /study throughput of two versions of the app.
+
+Each version runs in its own temporary directory with copies of the
+databases, and is driven by --workers processes (like gunicorn workers
+sharing one set of files), each with its own logged-in test client. A
+worker loops over GET /study followed by a POST that answers the problem,
+so content reads and attempt writes are interleaved across processes.
+Answers are written with ATTEMPT_DURABILITY=immediate unless the variable
+is already set, so every POST commits before it returns.
+
+"before" is the app as of --before (a git revision, default HEAD~1,
+exported with `git archive`); "after" is the working tree. Problems the
+bank has no precompiled HTML for go through Pandoc and the render cache
+(copied too), so run the importer first for numbers that measure only the
+databases.
+
+Usage: python3 scripts/bench_study.py [--before REV] [--workers N] [--seconds S]
+"""
+
+import argparse
+import multiprocessing
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DATABASES = ('problems.db', 'users.db', 'render_cache.db')
+PROBLEM_ID = re.compile(rb'name="problem_id" value="(\d+)"')
+
+
+def export_revision(rev, dest):
+    """Write the tracked files of `rev` to `dest`."""
+    archive = subprocess.run(['git', 'archive', '--format=tar', rev], cwd=BASE,
+                             check=True, capture_output=True).stdout
+    tar_path = dest + '.tar'
+    with open(tar_path, 'wb') as f:
+        f.write(archive)
+    with tarfile.open(tar_path) as tar:
+        tar.extractall(dest, filter='data')
+    os.remove(tar_path)
+
+
+def copy_databases(dest):
+    """Consistent copies of the app's databases (WAL contents included)."""
+    for name in DATABASES:
+        if not os.path.exists(os.path.join(BASE, name)):
+            continue
+        src = sqlite3.connect(os.path.join(BASE, name))
+        dst = sqlite3.connect(os.path.join(dest, name))
+        src.backup(dst)
+        dst.close()
+        src.close()
+
+
+def load_app(tree, rundir):
+    os.chdir(rundir)
+    sys.path.insert(0, tree)
+    import app
+    return app.app
+
+
+def login(client, username):
+    client.post('/register', data={'username': username, 'password': 'bench', 'confirmation': 'bench'})
+    client.post('/login', data={'username': username, 'password': 'bench'})
+
+
+def prepare(tree, rundir):
+    """Run the app's startup (migrations) once before the workers start."""
+    load_app(tree, rundir)
+
+
+def worker(tree, rundir, index, start_at, seconds):
+    client = load_app(tree, rundir).test_client()
+    login(client, f'bench{index}')
+    requests = 0
+    answer = 'right' if index % 2 else 'wrong'
+
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        page = client.get('/study')
+        requests += 1
+        match = PROBLEM_ID.search(page.data)
+        if match is None:
+            continue
+        client.post('/study', data={'action': answer, 'problem_id': match.group(1), 'topic': 'Any'})
+        requests += 1
+    return requests
+
+
+def run(label, tree, rundir, workers, seconds):
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1) as pool:
+        pool.apply(prepare, (tree, rundir))
+    with ctx.Pool(workers) as pool:
+        # leave time for every worker to import the app before the clock starts
+        start_at = time.time() + 2 + 0.2 * workers
+        results = [pool.apply_async(worker, (tree, rundir, i, start_at, seconds)) for i in range(workers)]
+        total = sum(r.get() for r in results)
+    rate = total / seconds
+    print(f'  {label:<7} {total:8,} requests in {seconds:.0f}s  {rate:8,.0f} requests/s')
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--before', default='HEAD~1',
+                        help='git revision to compare against (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    os.environ.setdefault('ATTEMPT_DURABILITY', 'immediate')
+    tmpdir = tempfile.mkdtemp()
+    try:
+        before_tree = os.path.join(tmpdir, 'before-src')
+        export_revision(args.before, before_tree)
+        rundirs = {}
+        for label in ('before', 'after'):
+            rundirs[label] = os.path.join(tmpdir, label)
+            os.mkdir(rundirs[label])
+            copy_databases(rundirs[label])
+
+        print(f'{args.workers} workers, ATTEMPT_DURABILITY={os.environ["ATTEMPT_DURABILITY"]}, '
+              f'before = {args.before}')
+        before = run('before', before_tree, rundirs['before'], args.workers, args.seconds)
+        after = run('after', BASE, rundirs['after'], args.workers, args.seconds)
+        print(f'  after/before: {after / before:.2f}x')
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,32 +2,140 @@
 """
 Rebuild `problems.db` schema and import problems from CSV.
 
-Behavior:
-- Drops and recreates `topics` and `problems` tables.
-- Prompts whether to delete existing `problem_attempts` data or migrate it into the new schema.
+Two modes (`--mode`):
+
+rebuild (default):
+- Builds a complete new bank in its own file next to `problems.db`
+  (`problems-<version>.db`), leaving the live database untouched while it works.
 - Imports problems from `static/cs50_problems.csv` into the new `problems` table and creates topics.
+  Problems keep their ids (matched on (year, problem)) and topics keep theirs (matched on
+  name); new ones get fresh ids. A CSV without a Year column is refused if the bank's
+  problems have years, unless `--match-without-year` says to match on the title alone.
+  The CSV is streamed in `--batch-size` chunks through `executemany`, so large banks
+  never have to fit in memory.
+- Precompiles each problem's LaTeX to HTML (clean -> Pandoc -> image paths) into
+  `html_text`/`html_answer`, with `html_hash` recording the source it was built from.
+- Re-applies the schema migrations in `migrations.py` (indexes etc.) to the rebuilt tables.
+- Stamps a new `bank_meta.version` so running app workers reload their cached view of the bank.
+- Keeps the attempts in `attempts.db` (`--attempts=migrate`) or deletes them
+  (`--attempts=drop`; asks interactively if the flag is omitted on a terminal). Once the new
+  bank is live, kept attempts at problems that are gone are deleted, and ones under a topic
+  that is gone move to the problem's first topic or 'Any'. Attempts still stored in an
+  old-style `problems.db` are copied to `attempts.db` before the old table is retired.
+- Validates the new file (integrity and foreign key checks, non-empty bank) and publishes it
+  by atomically repointing the `problems.db` symlink. Running apps notice the swap and reopen their connections and
+  caches on their next request. The previous bank file is kept for rollback, older ones
+  are deleted. The first run turns a plain `problems.db` file into the symlink (a copy of
+  the old bank is kept as the previous version).
+- `--in-place` instead drops and recreates the tables inside the live database, in one
+  transaction (for systems without symlinks).
+
+upsert:
+- Matches CSV rows to existing problems on (year, problem) and keeps their ids (a CSV
+  without a Year column is refused if the bank's problems have years).
+- Inserts new problems, updates changed text in place and applies only the
+  added/removed tags to `problem_topics`.
+- Leaves `attempts.db` alone, and keeps problems that are no longer in the CSV
+  (attempts may still point at them).
+- Only new or changed problems are precompiled again; the rest keep their HTML.
+- Stamps a new `bank_meta.version` only if something changed.
+
+Either way, if any step fails `problems.db` is left as it was. `--dry-run` runs the
+whole import and then throws the result away.
+
+Usage:
+    python3 scripts/import_problems.py --attempts=migrate [--csv PATH] [--db PATH] [--attempts-db PATH]
+                                       [--batch-size N] [--dry-run] [--in-place] [--match-without-year]
+    python3 scripts/import_problems.py --mode=upsert [--csv PATH] [--db PATH]
+                                       [--batch-size N] [--dry-run]
 
 NOTE: Back up `problems.db` before running.
 """
 
+import argparse
 import csv
+import glob
 import os
 import sqlite3
 import sys
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.request import pathname2url
 
 BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 DB_PATH = os.path.join(BASE, 'problems.db')
+ATTEMPTS_DB_PATH = os.path.join(BASE, 'attempts.db')
 CSV_PATH = os.path.join(BASE, 'static', 'cs50_problems.csv')
 
-if not os.path.exists(DB_PATH):
-    print(f"Database not found at {DB_PATH}")
-    sys.exit(1)
-
-print(f"Using DB: {DB_PATH}")
-print(f"CSV: {CSV_PATH}")
+# Share the app's rendering pipeline (and its render cache)
+sys.path.insert(0, BASE)
+import migrations  # noqa: E402
+from latex import render_many, source_hash  # noqa: E402
+
+DEFAULT_BATCH_SIZE = 1000
+ATTEMPT_PROGRESS_EVERY = 100_000
+FLAG_VALUES = ('1', 'true', 'yes', 'y')
+
+# Connection settings for bulk work: a large page cache and in-memory temp
+# storage. Durability stays at NORMAL for the connections that write live
+# files (attempts.db, and problems.db in --in-place and upsert runs); a new
+# bank file is built with BUILD_PRAGMAS on top, which turn it off.
+BULK_PRAGMAS = (
+    'PRAGMA cache_size = -65536',  # 64 MiB
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA synchronous = NORMAL',
+)
+
+# A new bank file is private until it is published, so it is built without
+# a journal on disk or fsyncs; it is synced once, right before the swap.
+# The published file is left in rollback-journal mode: the app only reads it.
+BUILD_PRAGMAS = (
+    'PRAGMA journal_mode = MEMORY',
+    'PRAGMA synchronous = OFF',
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild or update problems.db from the problems CSV.')
+    parser.add_argument('--mode', choices=('rebuild', 'upsert'), default='rebuild',
+                        help='drop and recreate the bank, or apply the CSV as a diff keyed on (year, problem)'
+                             ' (default: %(default)s)')
+    parser.add_argument('--attempts', choices=('migrate', 'drop'),
+                        help='rebuild mode: keep the attempts in the attempts database or delete them')
+    parser.add_argument('--csv', default=CSV_PATH, help='problems CSV (default: %(default)s)')
+    parser.add_argument('--db', default=DB_PATH, help='problems database (default: %(default)s)')
+    parser.add_argument('--attempts-db', default=ATTEMPTS_DB_PATH,
+                        help='attempts database (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='rows per executemany batch (default: %(default)s)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='run the whole import, report what it did, then roll it back')
+    parser.add_argument('--match-without-year', action='store_true',
+                        help='rebuild mode: if the CSV has no Year column but the bank has years,'
+                             ' match problems on their title alone instead of stopping')
+    parser.add_argument('--in-place', action='store_true',
+                        help='rebuild mode: rewrite the live database in one transaction instead of'
+                             ' building a new file and swapping it in')
+    args = parser.parse_args(argv)
+
+    if args.batch_size < 1:
+        parser.error('--batch-size must be at least 1')
+    if args.mode == 'upsert':
+        if args.attempts is not None:
+            parser.error('--attempts only applies to --mode=rebuild (upsert never touches attempts)')
+        if args.match_without_year:
+            parser.error('--match-without-year only applies to --mode=rebuild')
+    elif args.attempts is None:
+        if not sys.stdin.isatty():
+            parser.error('--attempts=migrate|drop is required when not running interactively')
+        # Ask user whether to delete problem_attempts data or migrate it
+        choice = None
+        while choice not in ('y', 'n'):
+            choice = input('\nDelete all existing problem attempts and start fresh? (y/n): ').strip().lower()
+        args.attempts = 'drop' if choice == 'y' else 'migrate'
+    return args
 
-conn = sqlite3.connect(DB_PATH)
-cur = conn.cursor()
 
 # Helper to read CSV headers/preview for debugging
 def preview_csv(path, n=3):
@@ -43,71 +151,136 @@ def preview_csv(path, n=3):
                 print('  ', r)
 
 
-try:
-    # Make a safe snapshot of existing problems & attempts
+def read_layout(path):
+    """Find the core columns and the topic flag columns in the CSV header.
+
+    Returns (year_idx, problem_idx, text_idx, topic_columns), where
+    topic_columns is a list of (column index, topic name), or None if the
+    CSV lacks the required columns.
+    """
+    with open(path, newline='') as f:
+        headers = next(csv.reader(f), [])
+
+    # Normalize header names
+    headers_norm = [h.strip() for h in headers]
+
+    # Find core columns: Year, Problem, Text (case-insensitive)
+    col_map = {name.lower(): i for i, name in enumerate(headers_norm)}
+    year_idx = col_map.get('year')
+    problem_idx = col_map.get('problem')
+    text_idx = col_map.get('text')
+
+    if problem_idx is None or text_idx is None:
+        print('CSV must include at least "Problem" and "Text" columns. Found headers:', headers_norm)
+        return None
+
+    # Topic flag columns are any columns after the 'Text' column in the CSV
+    topic_columns = [(i, headers_norm[i]) for i in range(text_idx + 1, len(headers_norm)) if headers_norm[i]]
+    return year_idx, problem_idx, text_idx, topic_columns
+
+
+def check_year_column(layout, bank_has_years, match_without_year=False):
+    """Refuse a CSV without a Year column for a bank whose problems have years.
+
+    Problems are matched on (year, problem), so such a CSV would match none
+    of them: every problem would get a new id and every kept attempt would
+    be deleted. With `match_without_year` the rebuild matches on the title
+    alone instead.
+    """
+    if layout[0] is None and bank_has_years and not match_without_year:
+        raise RuntimeError('the CSV has no Year column but the problems in the bank have years, so no problem '
+                           'would keep its id; add the Year column (or, for a rebuild, pass --match-without-year '
+                           'to match on the title alone)')
+
+
+def iter_problems(path, layout):
+    """Stream (year, problem, text, flagged topic names) for each usable CSV row."""
+    year_idx, problem_idx, text_idx, topic_columns = layout
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # header
+        for row in reader:
+            # protect against short rows
+            if len(row) <= max(problem_idx, text_idx):
+                continue
+            year_val = row[year_idx].strip() if year_idx is not None and year_idx < len(row) else None
+            problem_val = row[problem_idx].strip()
+            text_val = row[text_idx].strip()
+            if not problem_val or not text_val:
+                continue
+            topics = [name for idx, name in topic_columns
+                      if idx < len(row) and row[idx].strip().lower() in FLAG_VALUES]
+            yield year_val, problem_val, text_val, topics
+
+
+def batched(iterable, size):
+    """Yield lists of up to `size` items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def snapshot_existing(cur):
+    """Make a safe snapshot of existing problems, topics & attempts.
+
+    Attempts are only found here in an old-style problems.db that still has
+    its own problem_attempts table.
+    """
     cur.execute("SELECT name FROM sqlite_master WHERE type='table';")
     tables = {r[0] for r in cur.fetchall()}
 
     orig_problems = {}
     if 'problems' in tables:
-        # Determine whether the old `problems` table had a `topic` column.
+        # Older schemas may lack the `year` and/or `topic` columns.
         cur.execute("PRAGMA table_info(problems);")
-        cols = [r[1] for r in cur.fetchall()]
-        if 'topic' in cols:
-            cur.execute('SELECT id, problem, answer, topic FROM problems;')
-            for id_, problem, answer, topic in cur.fetchall():
-                orig_problems[id_] = {'problem': problem, 'answer': answer, 'topic': topic}
-        else:
-            # older schema: no `topic` column
-            cur.execute('SELECT id, problem, answer FROM problems;')
-            for id_, problem, answer in cur.fetchall():
-                orig_problems[id_] = {'problem': problem, 'answer': answer, 'topic': None}
+        cols = {r[1] for r in cur.fetchall()}
+        year_col = 'year' if 'year' in cols else 'NULL'
+        topic_col = 'topic' if 'topic' in cols else 'NULL'
+        cur.execute(f'SELECT id, {year_col}, problem, answer, {topic_col} FROM problems;')
+        for id_, year, problem, answer, topic in cur.fetchall():
+            orig_problems[id_] = {'year': year, 'problem': problem, 'answer': answer, 'topic': topic}
     else:
         print('No existing `problems` table found.')
 
+    orig_topics = {}
+    if 'topics' in tables:
+        orig_topics = dict(cur.execute('SELECT name, id FROM topics').fetchall())
+
     orig_attempts = []
     if 'problem_attempts' in tables:
-            # Inspect existing problem_attempts schema and load rows robustly.
-            cur.execute("PRAGMA table_info(problem_attempts);")
-            pa_cols = [r[1] for r in cur.fetchall()]
-            if pa_cols:
-                cur.execute('SELECT * FROM problem_attempts;')
-                rows = cur.fetchall()
-                for row in rows:
-                    rowdict = dict(zip(pa_cols, row))
-                    aid = rowdict.get('id')
-                    user_id = rowdict.get('user_id')
-                    problem_id = rowdict.get('problem_id')
-                    # older schemas might store a topic name in `topic` or a topic id in `topic_id`
-                    old_topic = rowdict.get('topic') if 'topic' in pa_cols else rowdict.get('topic_id') if 'topic_id' in pa_cols else None
-                    correct = rowdict.get('correct')
-                    attempted_at = rowdict.get('attempted_at')
-                    orig_attempts.append((aid, user_id, problem_id, old_topic, correct, attempted_at))
-            print(f'Found {len(orig_attempts)} existing attempts (will handle based on your choice).')
-    else:
-        print('No existing `problem_attempts` table found.')
+        orig_attempts = read_attempts(cur)
+        print(f'Found {len(orig_attempts)} attempts stored in the problems database.')
 
-    # Preview CSV to help user if nothing is importing
-    preview_csv(CSV_PATH)
+    return orig_problems, orig_topics, orig_attempts
 
-    # Ask user whether to delete problem_attempts data or migrate it
-    choice = None
-    while choice not in ('y', 'n'):
-        choice = input('\nDelete all existing `problem_attempts` data and start fresh? (y/n): ').strip().lower()
 
-    delete_attempts = (choice == 'y')
+def read_attempts(cur):
+    """Load problem_attempts as (id, user_id, problem_id, old topic, correct, attempted_at).
 
-    print('\nProceeding: will drop & recreate `topics` and `problems` tables.')
-    if delete_attempts:
-        print('You chose to remove existing problem_attempts data (will create an empty table).')
-    else:
-        print('You chose to migrate existing problem_attempts records where possible.')
+    Only the columns the migration keeps are read; ones an older schema lacks
+    come back as NULL.
+    """
+    cur.execute("PRAGMA table_info(problem_attempts);")
+    pa_cols = [r[1] for r in cur.fetchall()]
+    if not pa_cols:
+        return []
+
+    def col(name):
+        return name if name in pa_cols else 'NULL'
+    # older schemas might store a topic name in `topic` or a topic id in `topic_id`
+    topic_col = 'topic' if 'topic' in pa_cols else col('topic_id')
+    return cur.execute(f'SELECT {col("id")}, {col("user_id")}, {col("problem_id")}, {topic_col}, '
+                       f'{col("correct")}, {col("attempted_at")} FROM problem_attempts').fetchall()
 
-    # Turn off FK checks while rebuilding
-    cur.execute('PRAGMA foreign_keys=OFF;')
 
-    # Drop tables if they exist
-    cur.execute('DROP TABLE IF EXISTS problem_attempts;')
+def rebuild_schema(cur):
+    # Drop tables if they exist. Attempts live in attempts.db; an old-style
+    # problem_attempts table here is only dropped once its rows are there.
     cur.execute('DROP TABLE IF EXISTS problems;')
     cur.execute('DROP TABLE IF EXISTS topics;')
     cur.execute('DROP TABLE IF EXISTS problem_topics;')
@@ -127,7 +300,10 @@ try:
         year TEXT,
         problem TEXT NOT NULL,
         text TEXT NOT NULL,
-        answer TEXT
+        answer TEXT,
+        html_text TEXT,
+        html_answer TEXT,
+        html_hash TEXT
     );
     ''')
 
@@ -142,157 +318,594 @@ try:
     );
     ''')
 
-    # Import CSV rows into new tables
-    imported = 0
-    if os.path.exists(CSV_PATH):
-        with open(CSV_PATH, newline='') as f:
-            reader = csv.reader(f)
-            try:
-                headers = next(reader)
-            except StopIteration:
-                headers = []
-
-            # Normalize header names
-            headers_norm = [h.strip() for h in headers]
-
-            # Find core columns: Year, Problem, Text (case-insensitive)
-            col_map = {name.lower(): i for i, name in enumerate(headers_norm)}
-            year_idx = col_map.get('year')
-            problem_idx = col_map.get('problem')
-            text_idx = col_map.get('text')
-
-            if problem_idx is None or text_idx is None:
-                print('CSV must include at least "Problem" and "Text" columns. Found headers:', headers_norm)
-            else:
-                # Topic flag columns are any columns after the 'Text' column in the CSV
-                topic_columns = []
-                if text_idx is not None:
-                    for i in range(text_idx + 1, len(headers_norm)):
-                        topic_name = headers_norm[i]
-                        if topic_name:
-                            topic_columns.append((i, topic_name))
-
-                # Insert topics for all topic columns so we have ids
-                for _, tname in topic_columns:
-                    cur.execute('INSERT OR IGNORE INTO topics (name) VALUES (?)', (tname,))
-
-                # Build mapping of topic header index -> topic_id
-                topic_index_to_id = {}
-                for idx, tname in topic_columns:
-                    cur.execute('SELECT id FROM topics WHERE name = ?', (tname,))
-                    row = cur.fetchone()
-                    if row:
-                        topic_index_to_id[idx] = row[0]
-
-                # Process rows
-                for row in reader:
-                    # protect against short rows
-                    if len(row) <= max(problem_idx, text_idx):
-                        continue
-                    year_val = row[year_idx].strip() if year_idx is not None and year_idx < len(row) else None
-                    problem_val = row[problem_idx].strip()
-                    text_val = row[text_idx].strip()
-                    # answer may not exist in this CSV; leave NULL
-                    if not problem_val or not text_val:
-                        continue
-                    cur.execute('INSERT INTO problems (year, problem, text, answer) VALUES (?,?,?,?)', (year_val, problem_val, text_val, None))
-                    pid = cur.lastrowid
-                    # For each topic flag column, if flagged (1/true), create relation
-                    for idx, tid in topic_index_to_id.items():
-                        if idx < len(row):
-                            val = row[idx].strip().lower()
-                            if val in ('1', 'true', 'yes', 'y'):
-                                cur.execute('INSERT OR IGNORE INTO problem_topics (problem_id, topic_id) VALUES (?,?)', (pid, tid))
-                    imported += 1
-        print(f'Imported {imported} problems from CSV.')
-    else:
+
+def import_problems(cur, csv_path, batch_size, orig_problems=None, orig_topics=None, match_without_year=False):
+    """Stream the CSV into the (empty) problems and problem_topics tables.
+
+    Ids are assigned here rather than read back with lastrowid, so each
+    batch is two executemany calls. Problems and topics that were already
+    in the bank (`orig_problems`/`orig_topics` from snapshot_existing) get
+    their old ids back, so attempts stay attached across rebuilds; new ones
+    are numbered after the highest old id. Returns the number of problems.
+    """
+    if not os.path.exists(csv_path):
         print('CSV file not found; no problems imported.')
+        return 0
+    layout = read_layout(csv_path)
+    if layout is None:
+        return 0
+
+    orig_problems = orig_problems or {}
+    orig_topics = orig_topics or {}
+    # Old ids by (year, problem), or by problem alone for banks without years
+    keyed_by_year = any(info['year'] is not None for info in orig_problems.values())
+    check_year_column(layout, keyed_by_year, match_without_year)
+    keyed_by_year = keyed_by_year and not match_without_year
+
+    # Topics for all topic columns (plus the catch-all, which attempts may be
+    # filed under), keeping old ids
+    topic_ids = {}
+    next_topic_id = max(orig_topics.values(), default=0) + 1
+    names = [name for _, name in layout[3]]
+    if 'Any' in orig_topics:
+        names.append('Any')
+    for name in names:
+        if name in topic_ids:
+            continue
+        if name in orig_topics:
+            topic_ids[name] = orig_topics[name]
+        else:
+            topic_ids[name] = next_topic_id
+            next_topic_id += 1
+    cur.executemany('INSERT INTO topics (id, name) VALUES (?, ?)', [(tid, name) for name, tid in topic_ids.items()])
 
-    # Recreate problem_attempts table (empty or migrated)
-    cur.execute('''
-    CREATE TABLE problem_attempts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        problem_id INTEGER NOT NULL,
-        topic_id INTEGER NOT NULL,
-        correct INTEGER NOT NULL,
-        attempted_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY(problem_id) REFERENCES problems(id),
-        FOREIGN KEY(topic_id) REFERENCES topics(id)
-    );
-    ''')
+    old_ids = {}
+    for pid in sorted(orig_problems):
+        info = orig_problems[pid]
+        old_ids.setdefault((info['year'], info['problem']) if keyed_by_year else info['problem'], pid)
+    next_id = max(orig_problems, default=0) + 1
+    used = set()
 
-    # If migrating attempts, insert preserved rows mapping to new problem ids by problem text where possible
-    migrated = 0
-    skipped = 0
-    if not delete_attempts and orig_attempts:
-        for aid, user_id, old_problem_id, old_topic_text, correct, attempted_at in orig_attempts:
-            # Try to get problem text from orig_problems mapping
-            problem_text = None
-            if old_problem_id in orig_problems:
-                problem_text = orig_problems[old_problem_id]['problem']
-            # If problem_text available, find new problem id by text
-            new_pid = None
-            if problem_text:
-                cur.execute('SELECT id FROM problems WHERE problem = ? LIMIT 1', (problem_text,))
-                r = cur.fetchone()
-                if r:
-                    new_pid = r[0]
-                    # find a topic_id for this problem from the problem_topics junction table
-                    cur.execute('SELECT topic_id FROM problem_topics WHERE problem_id = ? LIMIT 1', (new_pid,))
-                    trow = cur.fetchone()
-                    new_tid = trow[0] if trow else None
+    imported = 0
+    kept = 0
+    start = time.perf_counter()
+    for batch in batched(iter_problems(csv_path, layout), batch_size):
+        problem_rows = []
+        topic_rows = []
+        for year_val, problem_val, text_val, topics in batch:
+            imported += 1
+            pid = old_ids.get((year_val, problem_val) if keyed_by_year else problem_val)
+            if pid is None or pid in used:
+                pid = next_id
+                next_id += 1
+            else:
+                kept += 1
+            used.add(pid)
+            # answer may not exist in this CSV; leave NULL
+            problem_rows.append((pid, year_val, problem_val, text_val, None))
+            topic_rows.extend((pid, topic_ids[name]) for name in topics)
+        cur.executemany('INSERT INTO problems (id, year, problem, text, answer) VALUES (?,?,?,?,?)', problem_rows)
+        cur.executemany('INSERT OR IGNORE INTO problem_topics (problem_id, topic_id) VALUES (?,?)', topic_rows)
+    elapsed = time.perf_counter() - start
+    print(f'Imported {imported} problems from CSV in {elapsed:.2f}s ({imported / max(elapsed, 1e-9):,.0f} rows/s); '
+          f'{kept} kept their ids, {imported - kept} are new.')
+    return imported
+
+
+def upsert_problems(cur, csv_path, batch_size):
+    """Apply the CSV to the existing bank as a diff keyed on (year, problem).
+
+    New problems are inserted, problems whose text changed are updated in
+    place (their stored HTML is cleared so precompile() redoes just those)
+    and problem_topics only gets the tags that were added or removed.
+    Returns the number of rows changed in problems and problem_topics.
+    """
+    if not os.path.exists(csv_path):
+        print('CSV file not found; nothing to update.')
+        return 0
+    layout = read_layout(csv_path)
+    if layout is None:
+        return 0
+    check_year_column(layout, cur.execute('SELECT 1 FROM problems WHERE year IS NOT NULL LIMIT 1').fetchone())
+
+    cur.executemany('INSERT OR IGNORE INTO topics (name) VALUES (?)', [(name,) for _, name in layout[3]])
+    topic_ids = dict(cur.execute('SELECT name, id FROM topics').fetchall())
+
+    existing = {
+        (year, problem): (pid, text)
+        for pid, year, problem, text in cur.execute('SELECT id, year, problem, text FROM problems')
+    }
+    tagged = {}
+    for pid, tid in cur.execute('SELECT problem_id, topic_id FROM problem_topics'):
+        tagged.setdefault(pid, set()).add(tid)
+    next_id = (cur.execute('SELECT MAX(id) FROM problems').fetchone()[0] or 0) + 1
+
+    inserted = updated = unchanged = tags_added = tags_removed = 0
+    start = time.perf_counter()
+    for batch in batched(iter_problems(csv_path, layout), batch_size):
+        inserts, updates, add_tags, remove_tags = [], [], [], []
+        for year_val, problem_val, text_val, topics in batch:
+            key = (year_val, problem_val)
+            if key not in existing:
+                pid = next_id
+                next_id += 1
+                inserts.append((pid, year_val, problem_val, text_val, None))
+                inserted += 1
+            else:
+                pid, old_text = existing[key]
+                if old_text != text_val:
+                    updates.append((text_val, pid))
+                    updated += 1
                 else:
-                    new_pid = None
-            # If we couldn't map by problem text, try to map by topic text (best-effort) -> insert with problem_id=0 skipped
-            if new_pid is None:
+                    unchanged += 1
+            existing[key] = (pid, text_val)
+
+            wanted = {topic_ids[name] for name in topics}
+            have = tagged.get(pid, set())
+            add_tags.extend((pid, tid) for tid in wanted - have)
+            remove_tags.extend((pid, tid) for tid in have - wanted)
+            tagged[pid] = wanted
+
+        cur.executemany('INSERT INTO problems (id, year, problem, text, answer) VALUES (?,?,?,?,?)', inserts)
+        cur.executemany('UPDATE problems SET text = ?, html_text = NULL, html_answer = NULL, html_hash = NULL '
+                        'WHERE id = ?', updates)
+        cur.executemany('INSERT OR IGNORE INTO problem_topics (problem_id, topic_id) VALUES (?,?)', add_tags)
+        cur.executemany('DELETE FROM problem_topics WHERE problem_id = ? AND topic_id = ?', remove_tags)
+        tags_added += len(add_tags)
+        tags_removed += len(remove_tags)
+
+    elapsed = time.perf_counter() - start
+    seen = inserted + updated + unchanged
+    print(f'Upserted {seen} CSV rows in {elapsed:.2f}s ({seen / max(elapsed, 1e-9):,.0f} rows/s): '
+          f'{inserted} new, {updated} changed, {unchanged} unchanged; '
+          f'{tags_added} topic tags added, {tags_removed} removed.')
+    kept = len({pid for pid, _ in existing.values()}) - seen
+    if kept > 0:
+        print(f'{kept} problems in the database are not in the CSV (kept).')
+    return inserted + updated + tags_added + tags_removed
+
+
+def precompile(cur, batch_size):
+    """Precompile LaTeX -> HTML so /study can serve it without calling Pandoc.
+
+    Only rows without stored HTML are rendered: every row after a rebuild,
+    new and changed rows after an upsert. Everything goes through one
+    batched Pandoc run; rows that fail to render keep NULL html and are
+    rendered on demand.
+    """
+    problem_rows = cur.execute('SELECT id, text, answer FROM problems WHERE html_hash IS NULL;').fetchall()
+    rendered = render_many([r[1] for r in problem_rows] + [r[2] for r in problem_rows])
+    texts, answers = rendered[:len(problem_rows)], rendered[len(problem_rows):]
+
+    updates = (
+        (html_text, html_answer, source_hash(text_val, answer_val), pid)
+        for (pid, text_val, answer_val), html_text, html_answer in zip(problem_rows, texts, answers)
+        if html_text is not None and (answer_val is None or html_answer is not None)
+    )
+    precompiled = 0
+    for batch in batched(updates, batch_size):
+        cur.executemany('UPDATE problems SET html_text = ?, html_answer = ?, html_hash = ? WHERE id = ?', batch)
+        precompiled += len(batch)
+    print(f'Precompiled HTML for {precompiled} problems.')
+    if precompiled < len(problem_rows):
+        print('  (is Pandoc installed? remaining problems will be rendered on demand)')
+
+
+def migrate_attempts(cur, orig_problems, orig_attempts, batch_size=DEFAULT_BATCH_SIZE, match_without_year=False):
+    """Insert preserved attempts, mapping them to the new problem ids.
+
+    Old problems are matched to new ones by (year, problem) when the old
+    table had a year (and not `match_without_year`), else by problem alone; each attempt takes the first
+    topic of its new problem, then its old topic (an id or a name), then
+    'Any'. All lookups are dicts built up front, so the cost per attempt is
+    a few hash lookups and the inserts go through executemany. `cur` is on
+    attempts.db with the new bank attached, so the unqualified bank tables
+    below resolve to it.
+
+    Attempts keep their old ids, so migrating the same table again (a rerun
+    after a failed swap) adds nothing. An id that attempts.db already uses
+    for a different attempt (one the app logged there) gets a fresh id.
+    """
+    new_ids = {}
+    for pid, year, problem in cur.execute('SELECT id, year, problem FROM problems ORDER BY id'):
+        new_ids.setdefault((year, problem), pid)
+        new_ids.setdefault(problem, pid)
+    first_topic = {}
+    for pid, tid in cur.execute('SELECT problem_id, MIN(topic_id) FROM problem_topics GROUP BY problem_id'):
+        first_topic[pid] = tid
+    topic_names = dict(cur.execute('SELECT name, id FROM topics').fetchall())
+    topic_ids = set(topic_names.values())
+
+    # old problem id -> (new problem id, its first topic id)
+    problem_map = {}
+    for old_pid, info in orig_problems.items():
+        if not info['problem']:
+            continue
+        by_year = info['year'] is not None and not match_without_year
+        key = (info['year'], info['problem']) if by_year else info['problem']
+        new_pid = new_ids.get(key)
+        if new_pid is not None:
+            problem_map[old_pid] = (new_pid, first_topic.get(new_pid))
+
+    # the schema migrations always create the catch-all topic
+    any_topic_id = topic_names.get('Any')
+    skipped = 0
+
+    ids = [a[0] for a in orig_attempts if a[0] is not None]
+    taken = {}
+    if ids:
+        taken = {aid: (user_id, attempted_at) for aid, user_id, attempted_at in cur.execute(
+            'SELECT id, user_id, attempted_at FROM main.problem_attempts WHERE id BETWEEN ? AND ?',
+            (min(ids), max(ids)))}
+    already = 0
+    renumbered = []
+
+    def rows():
+        nonlocal skipped, already
+        for aid, user_id, old_problem_id, old_topic, correct, attempted_at in orig_attempts:
+            mapped = problem_map.get(old_problem_id)
+            if mapped is None:
                 skipped += 1
                 continue
-            # Determine topic_id: prefer problem's topic_id; fall back to attempting to map from old topic text/id
-            topic_id = new_tid
+            new_pid, topic_id = mapped
+            if topic_id is None and old_topic:
+                # the old topic could be a topic id or a topic name
+                try:
+                    maybe_id = int(old_topic)
+                except (TypeError, ValueError):
+                    topic_id = topic_names.get(old_topic)
+                else:
+                    topic_id = maybe_id if maybe_id in topic_ids else None
             if topic_id is None:
-                # Try to use old_topic_text if present (could be a topic name or id)
-                if old_topic_text:
-                    try:
-                        # if it's numeric, treat as id
-                        maybe_id = int(old_topic_text)
-                        cur.execute('SELECT id FROM topics WHERE id = ? LIMIT 1', (maybe_id,))
-                        if cur.fetchone():
-                            topic_id = maybe_id
-                    except Exception:
-                        # treat as topic name
-                        cur.execute('SELECT id FROM topics WHERE name = ? LIMIT 1', (old_topic_text,))
-                        r = cur.fetchone()
-                        if r:
-                            topic_id = r[0]
-                # final fallback: ensure 'Any' topic exists and use it
-                if topic_id is None:
-                    cur.execute('INSERT OR IGNORE INTO topics (name) VALUES (?)', ('Any',))
-                    cur.execute('SELECT id FROM topics WHERE name = ? LIMIT 1', ('Any',))
-                    topic_id = cur.fetchone()[0]
-            # Insert preserving id if possible
-            cur.execute('INSERT INTO problem_attempts (user_id, problem_id, topic_id, correct, attempted_at) VALUES (?,?,?,?,?)',
-                        (user_id, new_pid, topic_id, correct, attempted_at))
-            migrated += 1
-
-    print(f'Migrated {migrated} attempts; skipped {skipped} attempts that could not be mapped.')
+                topic_id = any_topic_id
+            row = (aid, user_id, new_pid, topic_id, correct, attempted_at)
+            if aid in taken:
+                if taken[aid] == (user_id, attempted_at):
+                    already += 1  # copied by an earlier run
+                else:
+                    renumbered.append((None,) + row[1:])
+                continue
+            yield row
 
+    total = len(orig_attempts)
+    migrated = 0
+    next_report = ATTEMPT_PROGRESS_EVERY
+    start = time.perf_counter()
+    insert = ('INSERT OR IGNORE INTO problem_attempts (id, user_id, problem_id, topic_id, correct, attempted_at) '
+              'VALUES (?,?,?,?,?,?)')
+    for batch in batched(rows(), batch_size):
+        cur.executemany(insert, batch)
+        migrated += len(batch)
+        if migrated + skipped + already >= next_report:
+            next_report += ATTEMPT_PROGRESS_EVERY
+            elapsed = time.perf_counter() - start
+            print(f'  {migrated + skipped + already:,}/{total:,} attempts processed '
+                  f'({(migrated + skipped + already) / max(elapsed, 1e-9):,.0f}/s)')
+    # after the rows keeping their ids, so a fresh id can't take one of theirs
+    for batch in batched(renumbered, batch_size):
+        cur.executemany(insert, batch)
+        migrated += len(batch)
+
+    elapsed = time.perf_counter() - start
+    print(f'Migrated {migrated} attempts in {elapsed:.2f}s ({total / max(elapsed, 1e-9):,.0f} attempts/s); '
+          f'skipped {skipped} attempts that could not be mapped'
+          + (f', {already} already in attempts.db' if already else '') + '.')
+
+
+@contextmanager
+def attempts_transaction(args, bank_path):
+    """A write transaction on attempts.db, with the bank at `bank_path` attached read-only as `bank`."""
+    migrations.migrate_file(args.attempts_db, migrations.ATTEMPTS_MIGRATIONS)
+    conn = sqlite3.connect(args.attempts_db, isolation_level=None, uri=True)
+    cur = conn.cursor()
+    try:
+        # the cache keeps the attempt indexes' pages in memory during a big migration
+        for pragma in BULK_PRAGMAS:
+            cur.execute(pragma)
+        cur.execute('ATTACH DATABASE ? AS bank', (f'file:{pathname2url(os.path.abspath(bank_path))}?mode=ro',))
+        cur.execute('BEGIN IMMEDIATE')
+        yield cur
+        cur.execute('COMMIT')
+    except BaseException:
+        if conn.in_transaction:
+            cur.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+
+def migrate_legacy_attempts(args, bank_path, orig_problems, legacy_attempts):
+    """Copy attempts from an old-style problems.db into attempts.db.
+
+    They are mapped onto the new bank at `bank_path`. This only inserts;
+    callers drop (or retire) the old table once it has committed, so a
+    failure here never loses the only copy of them.
+    """
+    with attempts_transaction(args, bank_path) as cur:
+        migrate_attempts(cur, orig_problems, legacy_attempts, args.batch_size, args.match_without_year)
+
+
+def reconcile_attempts(args, bank_path):
+    """Bring attempts.db in line with the live bank at `bank_path`.
+
+    Ids survive a rebuild, so attempts only need touching where the bank
+    lost something: attempts at problems that are gone are deleted, and
+    ones filed under a topic that is gone move to the problem's first topic
+    (or 'Any'). With --attempts=drop every attempt is deleted. Run this
+    only once the new bank is live: it also catches attempts the app logged
+    against the old bank, and running it again is harmless.
+    """
+    with attempts_transaction(args, bank_path) as cur:
+        if args.attempts == 'drop':
+            dropped = cur.execute('DELETE FROM main.problem_attempts').rowcount
+            print(f'Deleted {dropped} attempts.')
+            return
+        gone = cur.execute('DELETE FROM main.problem_attempts '
+                           'WHERE problem_id NOT IN (SELECT id FROM bank.problems)').rowcount
+        moved = cur.execute('''
+            UPDATE main.problem_attempts SET topic_id = COALESCE(
+                (SELECT MIN(pt.topic_id) FROM bank.problem_topics pt
+                 WHERE pt.problem_id = problem_attempts.problem_id),
+                (SELECT id FROM bank.topics WHERE name = 'Any'))
+            WHERE topic_id NOT IN (SELECT id FROM bank.topics)
+        ''').rowcount
+    print(f'Attempts: deleted {gone} at problems no longer in the bank, '
+          f'moved {moved} off topics no longer in the bank.')
+
+
+def finish(cur, version=None):
+    """Sequences, schema migrations and the new bank version stamp."""
     # Update sqlite_sequence
-    for tbl in ('topics', 'problems', 'problem_attempts'):
+    for tbl in ('topics', 'problems'):
         cur.execute(f'SELECT MAX(id) FROM {tbl}')
         m = cur.fetchone()[0] or 0
         cur.execute('INSERT OR REPLACE INTO sqlite_sequence(name, seq) VALUES (?, ?)', (tbl, m))
 
-    conn.commit()
-    cur.execute('PRAGMA foreign_keys=ON;')
-    conn.commit()
-    print('\nRebuild + import complete.')
+    # Recreate indexes and any other schema the app expects on the new tables.
+    # problem_attempts isn't one of them: a table still in problems.db is an
+    # old layout the attempt indexes don't fit, migrated and dropped later.
+    steps = [(version, step) for version, step in migrations.PROBLEMS_MIGRATIONS
+             if step is not migrations._problems_attempt_indexes]
+    migrations.migrate(cur.connection, steps, force=True)
+
+    # Stamp a new bank version so running apps reload their in-memory views
+    cur.execute("INSERT OR REPLACE INTO bank_meta (key, value) VALUES ('version', ?)",
+                (version or uuid.uuid4().hex,))
+
+
+def validate(cur):
+    """Sanity checks on a freshly built bank before it is published."""
+    result = cur.execute('PRAGMA integrity_check').fetchone()[0]
+    if result != 'ok':
+        raise RuntimeError(f'integrity check failed: {result}')
+    bad_ref = cur.execute('PRAGMA foreign_key_check').fetchone()
+    if bad_ref is not None:
+        raise RuntimeError(f'foreign key check failed: {tuple(bad_ref)}')
+    counts = {tbl: cur.execute(f'SELECT COUNT(*) FROM {tbl}').fetchone()[0]
+              for tbl in ('problems', 'topics', 'problem_topics')}
+    if not counts['problems']:
+        raise RuntimeError('the new bank has no problems')
+    print('Validated new bank: ' + ', '.join(f'{n} {tbl}' for tbl, n in counts.items()) + '.')
+
+
+def bank_file(db_path, version):
+    """Path of the file holding bank `version`, next to the `db_path` symlink."""
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), f'{stem}-{version}.db')
+
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def publish(db_path, new_path):
+    """Atomically repoint the `db_path` symlink at `new_path`."""
+    link_tmp = db_path + '.swap'
+    if os.path.lexists(link_tmp):
+        os.remove(link_tmp)
+    try:
+        os.symlink(os.path.basename(new_path), link_tmp)
+    except OSError as e:
+        raise RuntimeError(f'cannot create a symlink next to {db_path} ({e}); use --in-place') from e
+    os.replace(link_tmp, db_path)
+    fsync_path(os.path.dirname(os.path.abspath(db_path)))
+
+
+def remove_old_versions(db_path, previous):
+    """Delete bank files other than the live one and `previous` (kept for rollback)."""
+    keep = {os.path.realpath(db_path), os.path.realpath(previous)}
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    pattern = os.path.join(os.path.dirname(os.path.abspath(db_path)), f'{stem}-*.db')
+    for path in glob.glob(pattern):
+        if os.path.realpath(path) in keep:
+            continue
+        for name in (path, path + '-wal', path + '-shm'):
+            if os.path.exists(name):
+                os.remove(name)
+        print(f'Removed old bank {os.path.basename(path)}.')
+
+
+def run_upsert(cur, args):
+    """--mode=upsert: apply the CSV as a diff, leaving ids and attempts alone."""
+    if not migrations._table_exists(cur.connection, 'problems'):
+        print('No existing `problems` table found; run with --mode=rebuild first.')
+        sys.exit(1)
+    # make sure the schema (html columns, bank_meta, 'Any' topic, ...) is current
+    migrations.migrate(cur.connection, migrations.PROBLEMS_MIGRATIONS)
+
+    changed = upsert_problems(cur, args.csv, args.batch_size)
+    precompile(cur, args.batch_size)
+    if changed:
+        # Stamp a new bank version so running apps reload their in-memory views
+        cur.execute("INSERT OR REPLACE INTO bank_meta (key, value) VALUES ('version', ?)", (uuid.uuid4().hex,))
+    else:
+        print('No changes; bank version left as is.')
+
 
-except Exception as e:
-    conn.rollback()
-    print('Error during rebuild/import:', e)
-    raise
+def run_rebuild(cur, args):
+    """--mode=rebuild --in-place: drop and recreate the bank inside the live database.
+
+    Returns what the attempt steps need once the rebuild is committed.
+    """
+    orig_problems, orig_topics, legacy_attempts = snapshot_existing(cur)
+
+    print('\nProceeding: will drop & recreate `topics` and `problems` tables.')
+
+    rebuild_schema(cur)
+    import_problems(cur, args.csv, args.batch_size, orig_problems, orig_topics, args.match_without_year)
+    precompile(cur, args.batch_size)
+    finish(cur)
+    return orig_problems, legacy_attempts
+
+
+def build_and_swap(args):
+    """--mode=rebuild: build the new bank in its own file, then publish it."""
+    version = uuid.uuid4().hex
+    new_path = bank_file(args.db, version)
+    published = False
+
+    # Autocommit mode: transactions below are explicit
+    live = sqlite3.connect(args.db, isolation_level=None)
+    build = sqlite3.connect(new_path, isolation_level=None)
+    try:
+        cur = live.cursor()
+        cur.execute('BEGIN')  # one read snapshot of the live bank
+        orig_problems, orig_topics, legacy_attempts = snapshot_existing(cur)
+        cur.execute('COMMIT')
+
+        print(f'\nProceeding: building the new bank in {os.path.basename(new_path)}.')
+
+        bcur = build.cursor()
+        for pragma in BULK_PRAGMAS + BUILD_PRAGMAS:
+            bcur.execute(pragma)
+        bcur.execute('BEGIN')
+        rebuild_schema(bcur)
+        import_problems(bcur, args.csv, args.batch_size, orig_problems, orig_topics, args.match_without_year)
+        precompile(bcur, args.batch_size)
+        finish(bcur, version)
+        bcur.execute('COMMIT')
+        validate(bcur)
+        build.close()
+
+        if args.dry_run:
+            print('\nDry run: the new bank was not published, the database is unchanged.')
+            return
+
+        if os.path.islink(args.db):
+            previous = os.path.realpath(args.db)
+        else:
+            # first swap: keep the current bank as the previous version
+            previous = bank_file(args.db, uuid.uuid4().hex)
+            backup = sqlite3.connect(previous)
+            live.backup(backup)
+            backup.close()
+            print(f'Kept the current bank as {os.path.basename(previous)}.')
+
+        # Old-style attempts are copied before the swap; the retired file
+        # keeps its table, so a failed swap leaves them where they were
+        if legacy_attempts and args.attempts != 'drop':
+            migrate_legacy_attempts(args, new_path, orig_problems, legacy_attempts)
+        fsync_path(new_path)
+        publish(args.db, new_path)
+        published = True
+
+        # Fold the retired file's WAL (if it has one) back into it and empty
+        # it: a stale WAL must never pair with a new file.
+        if cur.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()[0]:
+            print('The old bank is still being read; its WAL is cleaned up when the app lets go of it.')
+    finally:
+        live.close()
+        build.close()
+        if not published:
+            for name in (new_path, new_path + '-journal'):
+                if os.path.exists(name):
+                    os.remove(name)
+
+    print(f'Published {os.path.basename(new_path)} as {args.db}.')
+    # Deletes and topic moves wait until the new bank is live
+    reconcile_attempts(args, args.db)
+    remove_old_versions(args.db, previous)
+
+
+def update_in_place(args):
+    """Upsert, or --in-place rebuild, inside one transaction on the live database."""
+    # Autocommit mode, so the one explicit transaction below covers the DDL too
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    cur = conn.cursor()
+    try:
+        for pragma in BULK_PRAGMAS:
+            cur.execute(pragma)
+        # Turn off FK checks while rebuilding (must be set outside a transaction)
+        cur.execute('PRAGMA foreign_keys=OFF;' if args.mode == 'rebuild' else 'PRAGMA foreign_keys=ON;')
+
+        cur.execute('BEGIN IMMEDIATE')
+
+        rebuilt = None
+        if args.mode == 'upsert':
+            run_upsert(cur, args)
+        else:
+            rebuilt = run_rebuild(cur, args)
+
+        if args.dry_run:
+            cur.execute('ROLLBACK')
+            print('\nDry run: rolled back, the database is unchanged.')
+        else:
+            cur.execute('COMMIT')
+            if rebuilt is not None:
+                orig_problems, legacy_attempts = rebuilt
+                if legacy_attempts:
+                    # the old table goes only once attempts.db has its rows
+                    if args.attempts != 'drop':
+                        migrate_legacy_attempts(args, args.db, orig_problems, legacy_attempts)
+                    cur.execute('DROP TABLE problem_attempts')
+                reconcile_attempts(args, args.db)
+
+    except Exception:
+        if conn.in_transaction:
+            cur.execute('ROLLBACK')
+        raise
+
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"Database not found at {args.db}")
+        sys.exit(1)
+
+    print(f"Using DB: {args.db}")
+    print(f"CSV: {args.csv}")
+
+    # Preview CSV to help user if nothing is importing
+    preview_csv(args.csv)
+
+    if not args.dry_run:
+        # the same one-time move the app makes at startup: attempts left in
+        # problems.db go to attempts.db first
+        migrations.migrate_file(args.attempts_db, migrations.ATTEMPTS_MIGRATIONS)
+        moved = migrations.move_attempts(args.db, args.attempts_db)
+        if moved:
+            print(f'Moved {moved} attempts from {args.db} to {args.attempts_db}.')
+
+    start = time.perf_counter()
+    try:
+        if args.mode == 'rebuild' and not args.in_place:
+            build_and_swap(args)
+        else:
+            update_in_place(args)
+    except Exception as e:
+        print('Error during rebuild/import:', e)
+        raise
+    if not args.dry_run:
+        print(f'\n{args.mode.capitalize()} complete in {time.perf_counter() - start:.2f}s.')
 
-finally:
-    conn.close()
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Server-side session storage for the app.
+
+The session only ever holds the logged-in user's id (plus flashed messages),
+so storing it is cheap however it is done. The backend is picked with
+SESSION_BACKEND:
+
+- "sqlite" (default): one row per session in sessions.db (SESSION_DB_PATH).
+  The table is indexed on its expiry time. Expired rows are purged every
+  SESSION_PURGE_INTERVAL seconds, and their pages are returned to the file
+  with an incremental vacuum. The browser only gets a random session id.
+- "cookie": Flask's signed cookie. Nothing is stored on the server at all.
+  The signature is checked against SECRET_KEY (generated into .secret_key
+  if unset), and cookies older than the TTL are rejected.
+- "filesystem": the previous Flask-Session file store, kept for comparison.
+
+Both new backends expire sessions SESSION_TTL seconds (default 31 days)
+after the last write. The sqlite backend also slides the expiry forward on
+use, but only once the row is older than SESSION_REFRESH seconds, so
+ordinary page views do not write to the database.
+"""
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+
+from database import Database
+
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite").lower()
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.db")
+SESSION_TTL = int(os.environ.get("SESSION_TTL", str(31 * 24 * 3600)))
+SESSION_REFRESH = int(os.environ.get("SESSION_REFRESH", "3600"))
+SESSION_PURGE_INTERVAL = int(os.environ.get("SESSION_PURGE_INTERVAL", "300"))
+SECRET_KEY_PATH = ".secret_key"
+
+BACKENDS = ("sqlite", "cookie", "filesystem")
+
+
+class SqliteSession(SecureCookieSession):
+    """Session dict that remembers its id and when its row expires."""
+
+    def __init__(self, initial=None, sid: str | None = None, expires_at: float | None = None):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+        # set by clear(): the next save issues a new id (e.g. on login/logout)
+        self.rotate = False
+
+    def clear(self) -> None:
+        super().clear()
+        self.rotate = True
+
+
+class SqliteSessionInterface(SessionInterface):
+    """Store sessions as JSON rows in a SQLite database."""
+
+    session_class = SqliteSession
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, path: str = SESSION_DB_PATH, ttl: int = SESSION_TTL,
+                 refresh: int = SESSION_REFRESH, purge_interval: int = SESSION_PURGE_INTERVAL):
+        self.ttl = ttl
+        self.refresh = refresh
+        self.purge_interval = purge_interval
+        self._create_schema(path)
+        self.db = Database(path)
+        self._last_purge = 0.0
+        self._purge_lock = threading.Lock()
+
+    @staticmethod
+    def _create_schema(path: str) -> None:
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            # Lets purges hand pages back to the file system. Only takes
+            # effect on a brand-new file, i.e. before Database switches it to WAL.
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    sid TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+        finally:
+            conn.close()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return self.session_class()
+
+        row = self.db.query_one(
+            "SELECT data, expires_at FROM sessions WHERE sid = ? AND expires_at > ?",
+            sid, time.time(),
+        )
+        if row is None:
+            # unknown or expired: start over with a fresh id on first write
+            return self.session_class()
+        try:
+            data = self.serializer.loads(row["data"])
+        except ValueError:
+            return self.session_class()
+        return self.session_class(data, sid=sid, expires_at=row["expires_at"])
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            # cleared (logout) or never used: drop the row and the cookie
+            if session.sid is not None:
+                self.db.run("DELETE FROM sessions WHERE sid = ?", session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            self._maybe_purge(now)
+            return
+
+        expires_at = now + self.ttl
+        if session.sid is None or session.rotate:
+            if session.sid is not None:
+                self.db.run("DELETE FROM sessions WHERE sid = ?", session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            self.db.run(
+                "INSERT INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)",
+                session.sid, self.serializer.dumps(dict(session)), expires_at,
+            )
+        elif session.modified:
+            self.db.run(
+                "UPDATE sessions SET data = ?, expires_at = ? WHERE sid = ?",
+                self.serializer.dumps(dict(session)), expires_at, session.sid,
+            )
+        elif session.expires_at is not None and session.expires_at < expires_at - self.refresh:
+            # sliding expiry, written at most once per `refresh` seconds
+            self.db.run("UPDATE sessions SET expires_at = ? WHERE sid = ?", expires_at, session.sid)
+        else:
+            return
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+        self._maybe_purge(now)
+
+    def _maybe_purge(self, now: float) -> None:
+        """Delete expired sessions, at most once per purge interval."""
+        if now - self._last_purge < self.purge_interval:
+            return
+        if not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_purge = now
+            if self.db.run("DELETE FROM sessions WHERE expires_at <= ?", now).rowcount:
+                self.db.run("PRAGMA incremental_vacuum").fetchall()
+        finally:
+            self._purge_lock.release()
+
+
+def _secret_key() -> str:
+    """SECRET_KEY from the environment, else one generated once and kept on disk."""
+    key = os.environ.get("SECRET_KEY")
+    if key:
+        return key
+    try:
+        # O_EXCL: if several workers start at once, exactly one writes the key
+        fd = os.open(SECRET_KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+    for _ in range(50):
+        with open(SECRET_KEY_PATH) as f:
+            key = f.read().strip()
+        if key:
+            return key
+        time.sleep(0.01)  # another worker is still writing it
+    raise RuntimeError(f"{SECRET_KEY_PATH} is empty")
+
+
+def init_app(app, backend: str = SESSION_BACKEND) -> None:
+    """Install the session backend named by `backend` on `app`."""
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown session backend: {backend}")
+
+    app.permanent_session_lifetime = timedelta(seconds=SESSION_TTL)
+    if backend == "sqlite":
+        app.session_interface = SqliteSessionInterface()
+    elif backend == "cookie":
+        # Flask's default interface; it rejects cookies older than
+        # permanent_session_lifetime
+        app.secret_key = _secret_key()
+    else:
+        from flask_session import Session
+        app.config["SESSION_TYPE"] = "filesystem"
+        Session(app)
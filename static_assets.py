@@ -0,0 +1,58 @@
+"""
+Content-hashed URLs for files under static/.
+
+`static_url("styles.css")` returns `/static/styles.css?v=<hash>`, where the
+hash is taken from the file's bytes. The URL changes whenever the file
+does, so responses for versioned URLs can be cached by browsers for a year
+as immutable (see the after_request hook in app.py). Hashes are cached per
+file and recomputed only when the file's mtime or size changes.
+"""
+
+import hashlib
+import os
+import threading
+
+from flask import url_for
+from werkzeug.security import safe_join
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+VERSION_ARG = "v"
+
+_versions: dict[str, tuple[tuple[int, int], str]] = {}
+_lock = threading.Lock()
+
+
+def asset_version(filename: str) -> str | None:
+    """Short content hash of static/<filename>, or None if it isn't a readable file."""
+    path = safe_join(STATIC_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+
+    cached = _versions.get(filename)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    version = digest.hexdigest()[:12]
+    with _lock:
+        _versions[filename] = (stamp, version)
+    return version
+
+
+def static_url(filename: str) -> str:
+    """URL for a static file, versioned by its content when it exists."""
+    version = asset_version(filename)
+    if version is None:
+        return url_for("static", filename=filename)
+    return url_for("static", filename=filename, **{VERSION_ARG: version})
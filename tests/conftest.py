@@ -0,0 +1,50 @@
+"""
+Shared fixtures.
+
+app.py opens users.db, problems.db and attempts.db relative to the working
+directory when it is imported, so the `app_module` fixture copies the repo's
+databases into a temporary directory, moves there for the whole test
+session and imports the app from it. The real files are never touched.
+"""
+
+import os
+import sqlite3
+import sys
+import uuid
+
+import pytest
+
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE)
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("app")
+    for name in ("users.db", "problems.db"):
+        src = sqlite3.connect(os.path.join(BASE, name))
+        dst = sqlite3.connect(workdir / name)
+        src.backup(dst)
+        dst.close()
+        src.close()
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import app
+        yield app
+        app.attempt_log.close()
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def login(app_module):
+    """Register a fresh user; returns (test client, user id)."""
+    def register():
+        client = app_module.app.test_client()
+        username = f"test-{uuid.uuid4().hex[:12]}"
+        client.post("/register", data={"username": username, "password": "pw", "confirmation": "pw"})
+        row = app_module.db.query_one("SELECT id FROM users WHERE username = ?", username)
+        return client, row["id"]
+    return register
@@ -0,0 +1,87 @@
+"""AttemptLog keeps attempts it could not write instead of dropping them."""
+
+import sqlite3
+
+import pytest
+
+import migrations
+from attempt_log import AttemptLog
+from database import Database
+
+
+@pytest.fixture
+def attempts_db(tmp_path):
+    path = str(tmp_path / "attempts.db")
+    migrations.migrate_file(path, migrations.ATTEMPTS_MIGRATIONS)
+    db = Database(path, busy_timeout=50)
+    yield db
+    db.close()
+
+
+def count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM problem_attempts").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def lock(path):
+    """A second connection holding the write lock."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    return conn
+
+
+def test_immediate_write_failure_reaches_the_caller(attempts_db):
+    log = AttemptLog(attempts_db, durability="immediate")
+    blocker = lock(attempts_db.path)
+    with pytest.raises(sqlite3.OperationalError):
+        log.record(1, 2, 3, True)
+    blocker.rollback()
+    log.record(1, 2, 3, True)
+    assert count(attempts_db.path) == 1
+
+
+def test_buffered_attempts_survive_a_locked_database(attempts_db):
+    log = AttemptLog(attempts_db, durability="buffered", flush_interval=0.01)
+    blocker = lock(attempts_db.path)
+    for problem_id in range(5):
+        log.record(1, problem_id, 3, False)
+    assert not log.flush(timeout=0.3)
+    assert len(log.pending_for(1)) == 5
+
+    blocker.rollback()
+    assert log.flush(timeout=5)
+    assert count(attempts_db.path) == 5
+    log.close()
+
+
+def test_rejected_attempt_does_not_stop_the_writer(attempts_db):
+    log = AttemptLog(attempts_db, durability="buffered", flush_interval=0.01)
+    log.record(1, 2, None, True)  # topic_id is NOT NULL
+    log.record(1, 3, 4, True)
+    assert log.flush(timeout=5)
+
+    log.record(1, 5, 4, False)
+    assert log.flush(timeout=5)
+    assert count(attempts_db.path) == 2
+    log.close()
+
+
+def test_immediate_rejected_attempt_raises(attempts_db):
+    log = AttemptLog(attempts_db, durability="immediate")
+    with pytest.raises(ValueError):
+        log.record(1, 2, None, True)
+    log.record(1, 3, 4, True)
+    assert count(attempts_db.path) == 1
+
+
+def test_writer_starts_on_first_record(attempts_db):
+    log = AttemptLog(attempts_db, durability="buffered", flush_interval=0.01)
+    assert log._thread is None
+    assert log.flush(timeout=0)
+    log.record(1, 2, 3, True)
+    assert log._thread.is_alive()
+    assert log.flush(timeout=5)
+    log.close()
@@ -0,0 +1,21 @@
+"""The catalog looks at problems.db at most once per check interval."""
+
+import time
+
+from catalog import ProblemCatalog
+
+
+def test_file_is_checked_once_per_interval(app_module, monkeypatch):
+    catalog = ProblemCatalog(app_module.problems_db, check_interval=0.5)
+    checks = []
+    file_state = catalog._file_state
+    monkeypatch.setattr(catalog, "_file_state", lambda: checks.append(1) or file_state())
+
+    for _ in range(50):
+        catalog.topics()
+        catalog.sample(catalog.ANY)
+    assert len(checks) == 1
+
+    time.sleep(0.5)
+    catalog.topics()
+    assert len(checks) == 2
@@ -0,0 +1,22 @@
+"""The batch endpoints accept what navigator.sendBeacon sends: JSON as text/plain."""
+
+import json
+
+
+def test_beacon_scores_are_saved(app_module, login):
+    client, user_id = login()
+    body = json.dumps({"scores": [12, 34]})
+    response = client.post("/submit_scores", data=body, content_type="text/plain;charset=UTF-8")
+    assert response.get_json() == {"success": True, "saved": 2}
+    rows = app_module.db.query("SELECT score FROM leaderboard WHERE user_id = ? ORDER BY score", user_id)
+    assert [row["score"] for row in rows] == [12, 34]
+
+
+def test_beacon_monty_results_are_saved(app_module, login):
+    client, user_id = login()
+    body = json.dumps({"results": [{"switched": True, "won": True}, {"switched": False, "won": False}]})
+    response = client.post("/monty_save_batch", data=body, content_type="text/plain;charset=UTF-8")
+    assert response.get_json() == {"success": True, "saved": 2}
+    totals = app_module.db.query_one("SELECT switch_attempts, stay_attempts FROM monty_totals WHERE user_id = ?",
+                                     user_id)
+    assert (totals["switch_attempts"], totals["stay_attempts"]) == (1, 1)
@@ -0,0 +1,48 @@
+"""render_many() only batches snippets whose HTML doesn't depend on their neighbours."""
+
+import html
+import re
+
+import pytest
+
+import latex
+from render_cache import RenderCache
+
+
+@pytest.fixture
+def pandoc_runs(monkeypatch):
+    """Replace Pandoc with a fake that wraps each paragraph in <p>; returns the inputs it saw."""
+    runs = []
+
+    def fake_pandoc(full_input, timeout=None):
+        runs.append(full_input)
+        paragraphs = [p.strip() for p in re.split(r"\n\s*\n", full_input) if p.strip()]
+        return "\n".join(f"<p>{html.escape(p)}</p>" for p in paragraphs)
+
+    monkeypatch.setattr(latex, "run_pandoc", fake_pandoc)
+    monkeypatch.setattr(latex, "get_pandoc_version", lambda: "test")
+    monkeypatch.setattr(latex, "get_latex_macros", lambda: "")
+    monkeypatch.setattr(latex, "_RENDER_CACHE", RenderCache(None))
+    return runs
+
+
+def test_plain_snippets_share_one_run(pandoc_runs):
+    results = latex.render_many(["$P(A)$", "$E(X)$", None, "$Var(X)$"])
+    assert len(pandoc_runs) == 1
+    assert results[2] is None
+    assert results[0] == "<p>$P(A)$</p>"
+
+
+@pytest.mark.parametrize("snippet", [
+    r"\newcommand{\pr}{P} $\pr(A)$",
+    r"See the note\footnote{It is short.}",
+    r"\section{Setup} Let $X$ be uniform.",
+    r"\begin{equation}x\label{eq:x}\end{equation}",
+    r"\def\E{\mathbb{E}} $\E X$",
+])
+def test_context_sensitive_snippets_render_alone(pandoc_runs, snippet):
+    results = latex.render_many(["$P(A)$", snippet, "$E(X)$"])
+    assert snippet in pandoc_runs  # converted as its own document
+    assert sum(snippet in run for run in pandoc_runs) == 1
+    assert not any("$E(X)$" in run and snippet in run for run in pandoc_runs)
+    assert results[1] == latex.render_latex(snippet)
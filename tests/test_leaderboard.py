@@ -0,0 +1,25 @@
+"""/leaderboard ranks every game unless ?best=1 asks for each user's best."""
+
+import pytest
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("", [30, 20]),
+    ("&best=0", [30, 20]),
+    ("&best=1", [30]),
+])
+def test_best_is_an_explicit_flag(app_module, login, query, expected):
+    client, user_id = login()
+    username = app_module.db.query_one("SELECT username FROM users WHERE id = ?", user_id)["username"]
+    for score in (20, 30):
+        app_module.db.run("INSERT INTO leaderboard (user_id, score) VALUES (?, ?)", user_id, score)
+
+    scores = []
+    page = 1
+    while True:
+        leaders = client.get(f"/leaderboard?per_page=100&page={page}{query}").get_json()["leaders"]
+        if not leaders:
+            break
+        scores += [row["score"] for row in leaders if row["username"] == username]
+        page += 1
+    assert scores == expected
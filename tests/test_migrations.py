@@ -0,0 +1,119 @@
+"""The migrations create the indexes the hot queries rely on (checked with EXPLAIN QUERY PLAN)."""
+
+import sqlite3
+
+import pytest
+
+import migrations
+
+# the queries as app.py runs them
+PROGRESS_STATS = """
+    SELECT
+        topic_id,
+        SUM(CASE WHEN correct = 1 THEN 1 ELSE 0 END) AS correct_count,
+        SUM(CASE WHEN correct = 0 THEN 1 ELSE 0 END) AS wrong_count,
+        COUNT(*) AS total
+    FROM problem_attempts
+    WHERE user_id = ?
+    GROUP BY topic_id
+"""
+WRONG_PROBLEMS = """
+    SELECT problem_id, MAX(attempted_at) AS last_attempt
+    FROM problem_attempts
+    WHERE user_id = ? AND correct = 0
+    GROUP BY problem_id
+    ORDER BY last_attempt DESC
+    LIMIT 50
+"""
+SOLVED_SET = "SELECT DISTINCT problem_id FROM problem_attempts WHERE user_id = ? AND correct = 1"
+LEADERBOARD = """
+    SELECT users.username, leaderboard.score, leaderboard.timestamp
+    FROM leaderboard
+    JOIN users ON users.id = leaderboard.user_id
+    ORDER BY leaderboard.score DESC, leaderboard.id
+    LIMIT ? OFFSET ?
+"""
+
+# users.db tables that predate the migrations
+USERS_SCHEMA = """
+    CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, username TEXT NOT NULL,
+                        hash TEXT NOT NULL, cash NUMERIC NOT NULL DEFAULT 10000.00);
+    CREATE TABLE leaderboard (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+                              score INTEGER NOT NULL, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP);
+    CREATE TABLE monty_stats (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+                              switched INTEGER NOT NULL, won INTEGER NOT NULL,
+                              timestamp DATETIME DEFAULT CURRENT_TIMESTAMP);
+"""
+
+
+def plan(conn, sql, *args):
+    return " | ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", args))
+
+
+@pytest.fixture
+def attempts_conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / "attempts.db")
+    migrations.migrate(conn, migrations.ATTEMPTS_MIGRATIONS)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def users_conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / "users.db")
+    conn.executescript(USERS_SCHEMA)
+    migrations.migrate(conn, migrations.USERS_MIGRATIONS)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("sql, index", [
+    (PROGRESS_STATS, "idx_attempts_user_topic"),
+    (WRONG_PROBLEMS, "idx_attempts_user_correct"),
+    (SOLVED_SET, "idx_attempts_user_correct"),
+])
+def test_attempt_queries_use_covering_indexes(attempts_conn, sql, index):
+    detail = plan(attempts_conn, sql, *[1] * sql.count("?"))
+    # a search by user on the index alone, never a scan of the table
+    assert f"SEARCH problem_attempts USING COVERING INDEX {index}" in detail, detail
+    assert "SCAN problem_attempts" not in detail, detail
+
+
+def test_leaderboard_is_read_in_score_order(users_conn):
+    detail = plan(users_conn, LEADERBOARD, 20, 0)
+    assert "idx_leaderboard_score" in detail, detail
+    assert "USE TEMP B-TREE FOR ORDER BY" not in detail, detail
+
+
+def test_bank_migrations_apply_to_an_empty_file(tmp_path):
+    conn = sqlite3.connect(tmp_path / "problems.db")
+    migrations.migrate(conn, migrations.PROBLEMS_MIGRATIONS)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == migrations.PROBLEMS_MIGRATIONS[-1][0]
+    conn.close()
+
+
+def test_monty_totals_follow_updates(users_conn):
+    users_conn.executemany("INSERT INTO monty_stats (user_id, switched, won) VALUES (?, ?, ?)",
+                           [(1, 1, 1), (1, 0, 0), (2, 1, 0)])
+    users_conn.execute("UPDATE monty_stats SET won = 1 WHERE user_id = 2")
+    users_conn.execute("UPDATE monty_stats SET user_id = 2, switched = 1 WHERE switched = 0")
+    totals = users_conn.execute("SELECT * FROM monty_totals ORDER BY user_id").fetchall()
+
+    migrations.rebuild_monty_totals(users_conn)
+    assert totals == users_conn.execute("SELECT * FROM monty_totals ORDER BY user_id").fetchall()
+    assert totals == [(1, 1, 1, 0, 0), (2, 2, 1, 0, 0)]
+
+
+def test_leaderboard_views_follow_updates(users_conn):
+    users_conn.executemany("INSERT INTO leaderboard (user_id, score) VALUES (?, ?)",
+                           [(1, 50), (1, 900), (2, 70)] + [(3, s) for s in range(10, 80, 10)])
+    users_conn.execute("UPDATE leaderboard SET score = 60 WHERE score = 900")  # a bad score, corrected
+    users_conn.execute("UPDATE leaderboard SET user_id = 2 WHERE score = 10")
+    views = [users_conn.execute(f"SELECT * FROM {t} ORDER BY 1").fetchall()
+             for t in ("leaderboard_top", "leaderboard_best")]
+
+    migrations.rebuild_leaderboard_views(users_conn)
+    assert views == [users_conn.execute(f"SELECT * FROM {t} ORDER BY 1").fetchall()
+                     for t in ("leaderboard_top", "leaderboard_best")]
+    assert 900 not in [row[2] for row in views[0]]
+    assert dict((u, s) for u, s, _ in views[1]) == {1: 60, 2: 70, 3: 70}
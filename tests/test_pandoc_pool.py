@@ -0,0 +1,24 @@
+"""A failing conversion fails only its own job; the pool keeps working."""
+
+from pandoc_pool import PandocPool
+
+OPTIONS = {"from": "latex", "to": "html", "html-math-method": "mathml", "resource-path": ["static"]}
+
+
+def test_failed_job_leaves_the_worker_running(monkeypatch):
+    pool = PandocPool("pandoc", OPTIONS, workers=1)
+
+    def convert(server, full_input, timeout):
+        if full_input == "bad":
+            raise KeyboardInterrupt  # even a BaseException must not kill the worker
+        return f"<p>{full_input}</p>"
+
+    monkeypatch.setattr(pool, "_convert", convert)
+    assert pool.convert("bad") is None
+    assert pool.convert("good") == "<p>good</p>"
+    assert len(pool._threads) == 1 and pool._threads[0].is_alive()
+
+
+def test_fallback_command_uses_the_server_options():
+    pool = PandocPool("pandoc", OPTIONS)
+    assert pool._command() == ["pandoc", "--from", "latex", "--to", "html", "--mathml", "--resource-path=static"]
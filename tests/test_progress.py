@@ -0,0 +1,45 @@
+"""/progress costs a fixed number of queries, however many problems a user got wrong."""
+
+import pytest
+
+
+def count_statements(app_module, client, path):
+    """GET `path` and return the SQL statements it ran against the app's databases."""
+    statements = []
+    # the test client serves requests on this thread, so these are the
+    # connections the request uses
+    conns = [app_module.db.connection(), app_module.attempts_db.connection(),
+             app_module.problems_db.connection()]
+    for conn in conns:
+        conn.set_trace_callback(statements.append)
+    try:
+        response = client.get(path)
+    finally:
+        for conn in conns:
+            conn.set_trace_callback(None)
+    assert response.status_code == 200
+    return statements
+
+
+def add_wrong_attempts(app_module, user_id, n_problems):
+    problem_ids = [r["id"] for r in app_module.problems_db.query(
+        "SELECT id FROM problems ORDER BY id LIMIT ?", n_problems)]
+    assert len(problem_ids) == n_problems
+    app_module.attempts_db.run_many(
+        "INSERT INTO problem_attempts (user_id, problem_id, topic_id, correct) VALUES (?, ?, ?, 0)",
+        [(user_id, pid, app_module.catalog.attempt_topic_id("Any", pid)) for pid in problem_ids],
+    )
+
+
+@pytest.mark.parametrize("n_problems", [1, 10, 50])
+def test_progress_query_count_does_not_grow(app_module, login, n_problems):
+    client, user_id = login()
+    client.get("/progress")  # warm up: catalog load, session row
+    baseline = count_statements(app_module, client, "/progress")
+
+    add_wrong_attempts(app_module, user_id, n_problems)
+    statements = count_statements(app_module, client, "/progress")
+
+    assert len(statements) == len(baseline), statements
+    # the per-topic stats and the wrong-problem list
+    assert len(statements) <= 2, statements
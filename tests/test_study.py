@@ -0,0 +1,11 @@
+"""/study tells the user when an answer could not be saved."""
+
+
+def test_rejected_immediate_write_is_reported(app_module, login, monkeypatch):
+    client, _ = login()
+    monkeypatch.setattr(app_module.attempt_log, "durability", "immediate")
+    monkeypatch.setattr(app_module.catalog, "attempt_topic_id", lambda topic, problem_id: None)
+    problem_id = app_module.problems_db.query_one("SELECT MIN(id) AS id FROM problems")["id"]
+
+    response = client.post("/study", data={"action": "right", "problem_id": str(problem_id), "topic": "Any"})
+    assert response.status_code == 503